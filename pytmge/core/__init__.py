@@ -1,17 +1,25 @@
-# coding: utf-8
-# Copyright (c) pytmge Development Team.
-
-"""
-This package contains core modules and classes
-for machine learning to predict materials.
-
-"""
-
-
-from .primary_data import elemental_data as ed
-from .primary_data import electron_orbital_attribute as eoa
-
-
-elemental_data = ed()
-element_list = elemental_data.symbols
-electron_orbital_attribute = eoa()
+# coding: utf-8
+# Copyright (c) pytmge Development Team.
+
+"""
+This package contains core modules and classes
+for machine learning to predict materials.
+
+"""
+
+
+from .primary_data import elemental_data as ed
+from .primary_data import electron_orbital_attribute as eoa
+from .primary_data import get_orbital_attributes_of_elements
+
+
+elemental_data = ed()  # loaded on first access.
+element_list = elemental_data.symbols
+
+
+def __getattr__(name):
+    # electron_orbital_attribute is computed on first access.
+    if name == 'electron_orbital_attribute':
+        globals()[name] = eoa()
+        return globals()[name]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
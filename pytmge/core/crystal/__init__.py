@@ -1,13 +1,15 @@
-# coding: utf-8
-# Copyright (c) pytmge Development Team.
-
-"""
-This package contains modules and classes
-for machine learning to predict crystals.
-
-"""
-
-
-from .chemical_formulas import extract_composition
-from .feature import feature_design
-from .dataset import data_preparation
+# coding: utf-8
+# Copyright (c) pytmge Development Team.
+
+"""
+This package contains modules and classes
+for machine learning to predict crystals.
+
+"""
+
+
+from .chemical_formulas import extract_composition, CompositionMatrix
+from .feature_store import FeatureStore
+from .feature import feature_design, Featurizer, VarianceFilter
+from .dataset import data_preparation, CompositionIndex
+from .serving import AsyncFeaturizer
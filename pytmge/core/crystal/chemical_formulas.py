@@ -1,117 +1,446 @@
-# coding: utf-8
-# Copyright (c) pytmge Development Team.
-
-'''
-Dealing with chemical formulas.
-
-The format of the chemical formulas is supposed to be like 'H2O1' or 'C60',
-whereas 'H2O' or 'C' is not ok.
-Do not use brakets.
-
-'''
-
-
-import re
-import numpy as np
-import pandas as pd
-
-from pytmge.core import element_list
-from pytmge.core.plugins import progressbar
-
-
-__author__ = 'Yang LIU'
-__maintainer__ = 'Yang LIU'
-__email__ = 'l_young@live.cn'
-__version__ = '1.0'
-__date__ = '2022/3/18'
-
-
-def check_format(cf: str):
-
-    is_proper_format = True
-
-    try:
-        elements_in_cf = re.split(r'[(0-9]*[\.]?[0-9]+', cf)
-        if elements_in_cf[-1] == '':
-            elements_in_cf = elements_in_cf[:-1]
-        else:
-            is_proper_format = False
-        if elements_in_cf == '':
-            is_proper_format = False
-        for e in elements_in_cf:
-            if e not in element_list:
-                is_proper_format = False
-                break
-    except Exception:
-        is_proper_format = False
-
-    if not is_proper_format:
-        print('\nchemical formula seems not right :', cf)
-
-    return is_proper_format
-
-
-def extract_composition(df_dataset):
-    '''
-    Extracting composition from chemical formulas.
-
-    Parameters
-    ----------
-    df_dataset : DataFrame
-        dataset of chemical formula and target variable.
-        chemical formulas as index.
-
-    Returns
-    -------
-    df_composition : DataFrame
-        composition.
-        chemical formulas as index, elements as columns.
-
-    '''
-
-    print('\n' + 'extracting composition of chemical formulas ...')
-
-    cfs = list(df_dataset.index)
-
-    dict_composition = {}
-    error_list = []
-    for i, cf in enumerate(cfs):
-
-        if pd.isnull(cf):
-            print('chemical formula No.', i + 1, 'is null ...')
-        else:
-            elements_in_cf = re.split(r'[(0-9]*[\.]?[0-9]+', cf)
-            contents_in_cf = list(map(float, re.findall(r'[0-9]*[\.]?[0-9]+', cf)))
-
-            is_proper_format = check_format(cf)
-
-            if is_proper_format:
-                # if the cf is an alloy, the sum of contents is close to 100, then normalize to 1.
-                if 99.5 <= np.nansum(contents_in_cf) <= 100.5:
-                    contents_in_cf = list(pd.Series(contents_in_cf) / 100)
-
-                dict_composition[cf] = {}
-                for e, c in zip(elements_in_cf, contents_in_cf):
-                    dict_composition[cf][e] = dict_composition[cf].get(e, 0.0) + c
-                    # Note: sometimes some elements appear multiple times in a cf.
-            else:
-                print('\nchemical formula No.', i + 1, 'seems not right :', cf)
-                error_list += [cf]
-
-        progressbar(i + 1, len(cfs))
-
-    print('getting DataFrame from dict ...')
-    df_0 = pd.DataFrame(index=list(dict_composition.keys()), columns=element_list).fillna(0)
-    df_composition = pd.DataFrame.from_dict(dict_composition, orient='index')
-    df_composition = (df_0 + df_composition).replace(0, np.nan)
-    df_composition = df_composition.loc[:, element_list] * 1
-    dict_composition = df_composition.fillna(0).to_dict(orient='index')
-
-    # print('saving...')
-    # df_composition.to_csv(str(Path(__file__).absolute().parent) + '\\' + 'df_composition.csv')
-    # print('df_composition.csv')
-    # with open(_path + 'dict_composition.json', 'w') as _f:
-    #     json.dump(dict_composition, _f)
-    # print('dict_composition.json')
-
-    return df_composition
+# coding: utf-8
+# Copyright (c) pytmge Development Team.
+
+'''
+Dealing with chemical formulas.
+
+The format of the chemical formulas is supposed to be like 'H2O1' or 'C60',
+whereas 'H2O' or 'C' is not ok.
+Do not use brakets.
+
+'''
+
+
+import re
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+from pytmge.core import element_list
+from pytmge.core.plugins import Progress, get_n_jobs
+
+
+__author__ = 'Yang LIU'
+__maintainer__ = 'Yang LIU'
+__email__ = 'l_young@live.cn'
+__version__ = '1.0'
+__date__ = '2022/3/18'
+
+
+_element_set = frozenset(element_list)
+_element_position = {e: i for i, e in enumerate(element_list)}
+
+# one token = an element symbol followed by its content, e.g. 'Cu0.99'.
+# re.split() keeps the groups, so a formula in proper format splits into
+# ['', e1, c1, '', e2, c2, ..., ''], nothing between or around the tokens.
+_token_pattern = re.compile(r'([A-Z][a-z]*)([0-9]*\.?[0-9]+)')
+
+
+@lru_cache(maxsize=2 ** 17)
+def parse_formula(cf: str):
+    '''
+    Parsing a chemical formula, in a single pass of a compiled regex.
+    The results are cached, for the datasets having many duplicate formulas.
+
+    Parameters
+    ----------
+    cf : str
+        chemical formula, like 'H2O1'.
+
+    Returns
+    -------
+    composition : tuple or None
+        ((element, content), ...) in order of first appearance,
+        the contents of an alloy (sum close to 100) normalized to 1.
+        None if the chemical formula is not in proper format.
+
+    '''
+
+    if not isinstance(cf, str):
+        return None
+
+    parts = _token_pattern.split(cf)
+    elements_in_cf = parts[1::3]
+    if not elements_in_cf or any(parts[0::3]) or not _element_set.issuperset(elements_in_cf):
+        return None
+    contents_in_cf = [float(c) for c in parts[2::3]]
+
+    # if the cf is an alloy, the sum of contents is close to 100, then normalize to 1.
+    if 99.5 <= sum(contents_in_cf) <= 100.5:
+        contents_in_cf = [c / 100 for c in contents_in_cf]
+
+    composition = {}
+    for e, c in zip(elements_in_cf, contents_in_cf):
+        composition[e] = composition.get(e, 0.0) + c
+        # Note: sometimes some elements appear multiple times in a cf.
+
+    return tuple(composition.items())
+
+
+def canonicalize_formula(cf: str):
+    '''
+    Canonical spelling of a chemical formula,
+    the elements in the order of element_list (atomic number) and the contents in their shortest form,
+    absent (zero content) elements dropped,
+    so that e.g. 'Fe2O3', 'O3Fe2', 'Fe2.0O3.0' and 'Fe2O3Al0' all give 'O3Fe2'.
+
+    Parameters
+    ----------
+    cf : str
+        chemical formula.
+
+    Returns
+    -------
+    canonical_cf : str or None
+        None if the chemical formula is not in proper format.
+
+    '''
+
+    composition = parse_formula(cf)
+    if composition is None:
+        return None
+
+    canonical_cf = ''
+    for e, c in sorted(composition, key=lambda x: _element_position[x[0]]):
+        if c != 0:
+            canonical_cf += e + _format_content(c)
+
+    return canonical_cf
+
+
+def _format_content(c):
+    # shortest form of a content, e.g. 2.0 -> '2', 0.99 -> '0.99'.
+    c = repr(float(c))
+    return c[:-2] if c.endswith('.0') else c
+
+
+def check_format(cf: str):
+
+    is_proper_format = parse_formula(cf) is not None
+
+    if not is_proper_format:
+        print('\nchemical formula seems not right :', cf)
+
+    return is_proper_format
+
+
+class CompositionMatrix:
+    '''
+    Sparse composition of chemical formulas,
+    in compressed sparse row format (indptr, element_index, fraction),
+    i.e. the contents of formula i are fraction[indptr[i]:indptr[i + 1]],
+    of the elements element_index[indptr[i]:indptr[i + 1]] (positions in element_list).
+
+    '''
+
+    def __init__(self, formulas, indptr, element_index, fraction, elements=None):
+        self.formulas = list(formulas)
+        self.indptr = np.asarray(indptr, dtype='int64')
+        self.element_index = np.asarray(element_index, dtype='int16')
+        self.fraction = np.asarray(fraction, dtype='float64')
+        self.elements = list(element_list if elements is None else elements)
+
+    @classmethod
+    def from_dict(cls, dict_composition):
+        '''
+        Parameters
+        ----------
+        dict_composition : dict
+            {chemical formula: {element: content} or ((element, content), ...)}.
+
+        '''
+
+        compositions = [c.items() if isinstance(c, dict) else c for c in dict_composition.values()]
+        lengths = np.fromiter((len(c) for c in compositions), dtype='int64', count=len(compositions))
+        nnz = int(lengths.sum())
+        element_index = np.fromiter((_element_position[e] for c in compositions for e, _ in c), dtype='int16', count=nnz)
+        fraction = np.fromiter((x for c in compositions for _, x in c), dtype='float64', count=nnz)
+
+        # elements of each formula in the order of element_list, absent (zero content) elements dropped.
+        rows = np.repeat(np.arange(len(compositions)), lengths)
+        order = np.lexsort((element_index, rows))
+        order = order[fraction[order] != 0]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[order], minlength=len(compositions)))])
+
+        return cls(dict_composition.keys(), indptr, element_index[order], fraction[order])
+
+    @classmethod
+    def from_dataframe(cls, df_composition):
+        '''
+        Parameters
+        ----------
+        df_composition : DataFrame
+            chemical formulas as index, elements as columns, absent elements are nan or 0.
+
+        '''
+
+        composition = np.nan_to_num(df_composition.to_numpy(dtype='float64'))
+        rows, columns = np.nonzero(composition)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=composition.shape[0]))])
+        return cls(df_composition.index, indptr, columns, composition[rows, columns], df_composition.columns)
+
+    @property
+    def shape(self):
+        return (len(self.formulas), len(self.elements))
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.element_index.nbytes + self.fraction.nbytes
+
+    def __len__(self):
+        return len(self.formulas)
+
+    def __getitem__(self, rows):
+        '''
+        Selecting formulas by position, with a slice, an int array or a boolean mask.
+
+        '''
+
+        rows = np.arange(len(self.formulas))[rows]
+        lengths = np.diff(self.indptr)[rows]
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.repeat(self.indptr[rows] - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return CompositionMatrix(
+            [self.formulas[i] for i in rows], indptr,
+            self.element_index[positions], self.fraction[positions], self.elements
+        )
+
+    def row_index(self):
+        # the formula (position) of each stored content.
+        return np.repeat(np.arange(len(self.formulas)), np.diff(self.indptr))
+
+    def canonical_formulas(self):
+        '''
+        Canonical spelling of the formulas, as canonicalize_formula(), but from their composition.
+
+        Returns
+        -------
+        canonical_cfs : list
+            canonical chemical formulas.
+
+        '''
+
+        rows = self.row_index()
+        positions = np.array([_element_position[e] for e in self.elements], dtype='int64')[self.element_index]
+        order = np.lexsort((positions, rows))
+        tokens = [
+            self.elements[i] + _format_content(c)
+            for i, c in zip(self.element_index[order].tolist(), self.fraction[order].tolist())
+        ]
+        canonical_cfs = [''.join(tokens[start:end]) for start, end in zip(self.indptr[:-1], self.indptr[1:])]
+
+        return canonical_cfs
+
+    def unique(self, normalize=True, decimals=12):
+        '''
+        Unique compositions.
+
+        Parameters
+        ----------
+        normalize : bool
+            whether to compare the fractions (contents / sum of contents) instead of the contents,
+            so that e.g. 'Y1Ba2Cu3O7' and 'Y2Ba4Cu6O14' are the same composition.
+        decimals : int
+            the fractions (or contents) are compared rounded to decimals.
+
+        Returns
+        -------
+        unique_composition : CompositionMatrix
+            the first formula of each unique composition, in order of first appearance.
+        inverse : ndarray
+            (formulas, ) position of the composition of each formula in unique_composition.
+
+        '''
+
+        element_index, weights = self.compact()
+        if normalize:
+            total = weights.sum(axis=1, keepdims=True)
+            weights = weights / np.where(total != 0, total, 1)
+        keys = np.hstack([element_index.astype('float64'), np.round(weights, decimals)])
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+
+        # in order of first appearance.
+        order = np.argsort(first, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+
+        return self[first[order]], rank[inverse.reshape(-1)]
+
+    def to_dense(self, dtype='float64'):
+        '''
+        Returns
+        -------
+        composition : ndarray
+            (formulas x elements), absent elements are 0.
+
+        '''
+
+        composition = np.zeros(self.shape, dtype=dtype)
+        composition[self.row_index(), self.element_index] = self.fraction
+        return composition
+
+    def to_dataframe(self):
+        '''
+        Returns
+        -------
+        df_composition : DataFrame
+            chemical formulas as index, elements as columns, absent elements are nan,
+            as returned by extract_composition().
+
+        '''
+
+        composition = np.full(self.shape, np.nan)
+        composition[self.row_index(), self.element_index] = self.fraction
+        return pd.DataFrame(composition, index=self.formulas, columns=self.elements)
+
+    def to_scipy(self):
+        # scipy is optional, only needed for this conversion.
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.fraction, self.element_index, self.indptr), shape=self.shape)
+
+    def compact(self):
+        '''
+        Compacting to the elements present in each formula.
+
+        Returns
+        -------
+        element_index : ndarray
+            (formulas x k) indices of the present elements,
+            padded with len(elements) (points to an empty row).
+        weights : ndarray
+            (formulas x k) contents of the present elements, padded with 0.
+
+        '''
+
+        lengths = np.diff(self.indptr)
+        k = max(int(lengths.max(initial=0)), 1)
+        rows = self.row_index()
+        columns = np.arange(len(rows)) - self.indptr[rows]
+
+        element_index = np.full((len(self.formulas), k), len(self.elements), dtype='int64')
+        weights = np.zeros((len(self.formulas), k))
+        element_index[rows, columns] = self.element_index
+        weights[rows, columns] = self.fraction
+
+        return element_index, weights
+
+
+def _parse_formulas(cfs, offset=0, show_progress=True):
+    '''
+    Parsing chemical formulas into dicts of elemental contents.
+
+    Parameters
+    ----------
+    cfs : list
+        chemical formulas.
+    offset : int
+        position of the first chemical formula in the dataset, for the messages.
+    show_progress : bool
+        whether to report the progress.
+
+    Returns
+    -------
+    dict_composition : dict
+        {chemical formula: ((element, content), ...)}.
+    error_list : list
+        chemical formulas not in proper format.
+
+    '''
+
+    dict_composition = {}
+    error_list = []
+    progress = Progress(len(cfs), 'parsing chemical formulas')
+    for i, cf in enumerate(cfs, start=offset):
+
+        if pd.isnull(cf):
+            print('chemical formula No.', i + 1, 'is null ...')
+        else:
+            composition = parse_formula(cf)
+
+            if composition is not None:
+                dict_composition[cf] = composition
+            else:
+                print('\nchemical formula No.', i + 1, 'seems not right :', cf)
+                error_list += [cf]
+
+        if show_progress:
+            progress.update(i + 1 - offset)
+
+    return dict_composition, error_list
+
+
+def extract_composition(df_dataset, n_jobs=1, sparse=False, executor=None):
+    '''
+    Extracting composition from chemical formulas.
+
+    Parameters
+    ----------
+    df_dataset : DataFrame
+        dataset of chemical formula and target variable.
+        chemical formulas as index.
+    n_jobs : int
+        number of processes parsing the chemical formulas, -1 means all CPUs.
+    sparse : bool
+        if True, return a CompositionMatrix, in the order of the dataset,
+        instead of the dense DataFrame.
+    executor : ProcessPoolExecutor, optional
+        pool of n_jobs processes to reuse instead of starting one.
+
+    Returns
+    -------
+    df_composition : DataFrame or CompositionMatrix
+        composition.
+        chemical formulas as index, elements as columns.
+
+    '''
+
+    print('\n' + 'extracting composition of chemical formulas ...')
+
+    cfs = list(df_dataset.index)
+
+    n_jobs = min(get_n_jobs(n_jobs), max(len(cfs), 1))
+    if n_jobs == 1:
+        dict_composition, error_list = _parse_formulas(cfs)
+    else:
+        # contiguous shards, merged in their original order.
+        shard_size = -(-len(cfs) // (4 * n_jobs))
+        offsets = list(range(0, len(cfs), shard_size))
+        dict_composition = {}
+        error_list = []
+        progress = Progress(len(cfs), 'parsing chemical formulas')
+        pool = ProcessPoolExecutor(max_workers=n_jobs) if executor is None else executor
+        try:
+            results = pool.map(
+                _parse_formulas,
+                [cfs[i:i + shard_size] for i in offsets],
+                offsets,
+                [False] * len(offsets)
+            )
+            for offset, (_dict_composition, _error_list) in zip(offsets, results):
+                dict_composition.update(_dict_composition)
+                error_list += _error_list
+                progress.update(min(offset + shard_size, len(cfs)))
+        finally:
+            if pool is not executor:
+                pool.shutdown()
+
+    if sparse:
+        return CompositionMatrix.from_dict(dict_composition)
+
+    print('getting DataFrame from dict ...')
+    dict_composition = {cf: dict(composition) for cf, composition in dict_composition.items()}
+    df_0 = pd.DataFrame(index=list(dict_composition.keys()), columns=element_list).fillna(0)
+    df_composition = pd.DataFrame.from_dict(dict_composition, orient='index')
+    df_composition = (df_0 + df_composition).replace(0, np.nan)
+    df_composition = df_composition.loc[:, element_list] * 1
+    dict_composition = df_composition.fillna(0).to_dict(orient='index')
+
+    # print('saving...')
+    # df_composition.to_csv(str(Path(__file__).absolute().parent) + '\\' + 'df_composition.csv')
+    # print('df_composition.csv')
+    # with open(_path + 'dict_composition.json', 'w') as _f:
+    #     json.dump(dict_composition, _f)
+    # print('dict_composition.json')
+
+    return df_composition
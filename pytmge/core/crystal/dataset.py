@@ -1,229 +1,554 @@
-# coding: utf-8
-# Copyright (c) pytmge Development Team.
-
-'''
-Classes for data preparation.
-
-'''
-
-
-import numpy as np
-import pandas as pd
-
-from pytmge.core.crystal import extract_composition
-from pytmge.core.plugins import progressbar
-
-
-__author__ = 'Yang LIU'
-__maintainer__ = 'Yang LIU'
-__email__ = 'l_young@live.cn'
-__version__ = '1.0'
-__date__ = '2022/3/18'
-
-
-class data_preparation:
-
-    def __init__(self):
-        pass
-
-    @staticmethod
-    def delete_duplicates(df_dataset):
-        '''
-        Delete duplicate entries in dataset.
-
-        If two or more entries have the same chemical formula
-        but different property values, keep the entry having greater value (of the first column).
-
-        Parameters
-        ----------
-        df_dataset : DataFrame
-            dataset of chemical formula and target variable.
-            chemical formulas as index.
-
-        Returns
-        -------
-        deduped_subset : DataFrame
-            deduped subset.
-
-        '''
-
-        print('\ndeleting duplicate entries in dataset ...')
-
-        # sort the dataset by the values of first column.
-        for col_name in list(df_dataset.columns)[::-1]:
-            df_dataset = df_dataset.sort_values(by=col_name)
-
-        deduped_subset = {}
-        for i, cf in enumerate(list(df_dataset.index)):
-            deduped_subset[cf] = df_dataset.loc[cf]
-            progressbar(i + 1, df_dataset.shape[0])
-
-        print('  original:', i + 1, '| deduped:', len(deduped_subset.keys()))
-
-        df_deduped_subset = pd.DataFrame.from_dict(deduped_subset, orient='index')
-        df_deduped_subset.sort_index(ascending=True, inplace=True)
-        # df_deduped_subset.sort_values(
-        #     by=list(df_deduped_subset.columns)[0],
-        #     ascending=False,
-        #     inplace=True
-        # )
-
-        return df_deduped_subset
-
-    @classmethod
-    def categorization_by_composition(cls, df_dataset):
-        '''
-        Categorizing the chemical formulas,
-        according to 'number_of_elements', 'element', and 'elemental_contents' (n-e-c).
-
-        Parameters
-        ----------
-        df_dataset : DataFrame
-            dataset of chemical formula and target variable.
-            chemical formulas as index.
-
-        Returns
-        -------
-        dict_category : dict
-            dict_category.
-
-        '''
-
-        print('\ncategorizing the chemical formulas ...')
-
-        df_composition = extract_composition(df_dataset)
-        cfs = list(df_composition.index)
-        _elements = list(df_composition.columns)
-
-        # elemental contents
-        contents = df_composition.fillna(0).applymap(lambda x: np.int(x + 0.5))
-
-        # number of elements in each chemical formula, ignore the element(s) that content < 0.5
-        number_of_elements = (df_composition.applymap(lambda x: x >= 0.5) * 1).sum(axis=1)
-
-        # print('labeling ...')
-        labels = {}
-        for cf in cfs:
-            labels[cf] = {}
-            i = 0
-            for e in _elements:
-                if contents.loc[cf, e] >= 0.5:
-                    i += 1
-                    # assign a category lable 'n-e-c' to each chemical formula
-                    n = str(round(number_of_elements[cf]))
-                    c = str(int(contents.loc[cf, e] + 0.5))
-                    labels[cf][i] = n + '-' + e + '-' + c
-
-        # print('categorizing ...')
-        dict_category = {}
-        for cf in cfs:
-            for label in labels[cf].values():
-                dict_category[label] = {}
-        for cf in cfs:
-            for label in labels[cf].values():
-                dict_category[label][cf] = df_dataset.loc[cf, :].to_dict()
-
-        return dict_category
-
-    @classmethod
-    def subset(cls, df_dataset):
-        '''
-        Getting subset.
-        For each category, pick one entry having the highest value of material property.
-
-        Parameters
-        ----------
-        df_dataset : DataFrame
-            dataset of chemical formula and target variable.
-            chemical formulas as index.
-
-        Returns
-        -------
-        df_subset : DataFrame
-            df_subset.
-
-        '''
-
-        dict_category = cls.categorization_by_composition(df_dataset)
-        dict_subset = {}
-        for category_label, dict_entries in dict_category.items():
-            df_entries = pd.DataFrame.from_dict(dict_entries, orient='index')
-            df_highest = df_entries.sort_values(by=df_entries.columns[0], ascending=False)
-            ds_highest = df_highest.iloc[0, :]
-            dict_subset[ds_highest.name] = ds_highest.to_dict()
-        df_subset = pd.DataFrame.from_dict(dict_subset, orient='index')
-        return df_subset
-
-    @staticmethod
-    def distances_within_dataset(df_dataset):
-        '''
-        Manhattan distances in composition space,
-        between each two chemical formulas in the dataset.
-
-        Parameters
-        ----------
-        df_dataset : DataFrame
-            dataset of chemical formula and target variable.
-            chemical formulas as index.
-
-        Returns
-        -------
-        df_distances : DataFrame
-            df_distances.
-            chemical formulas as index and columns.
-
-        '''
-
-        df_composition = extract_composition(df_dataset)
-        cfs = list(df_composition.index)
-        df_distances = pd.DataFrame(index=cfs, columns=cfs, dtype='float')
-        c = df_composition.fillna(0)
-
-        for i, cf in enumerate(cfs):
-            d = np.abs(c - c.loc[cf, :])
-            df_distances[cf] = np.nansum(d, axis=1)
-
-            progressbar(i + 1, len(cfs))
-
-        return df_distances
-
-    @staticmethod
-    def distances_between_datasets(df_dataset_0, df_dataset_1):
-        '''
-        Manhattan distances in composition space,
-        from each point in dataset_0 to the points in dataset_1.
-
-        Parameters
-        ----------
-        df_dataset_0 : DataFrame
-            df_composition, derived from class 'dataset' .
-            chemical formulas as index, elements as columns.
-
-        df_dataset_1 : DataFrame
-            df_composition, derived from class 'dataset' .
-            chemical formulas as index, elements as columns.
-
-        Returns
-        -------
-        df_distances : DataFrame
-            df_distances.
-            chemical formulas in dataset_0 as index.
-
-        '''
-
-        df_composition_0 = extract_composition(df_dataset_0)
-        df_composition_1 = extract_composition(df_dataset_1)
-        c0 = df_composition_0.fillna(0)
-        c1 = df_composition_1.fillna(0)
-        cfs0 = list(df_composition_0.index)
-        cfs1 = list(df_composition_1.index)
-
-        df_distances = pd.DataFrame(index=cfs0, columns=cfs1, dtype='float')
-
-        for i, cf in enumerate(cfs1):
-            _d = np.abs(c0 - c1.loc[cf, :])
-            df_distances[cf] = np.nansum(_d, axis=1)
-
-            progressbar(i + 1, len(cfs1))
-
-        return df_distances
+# coding: utf-8
+# Copyright (c) pytmge Development Team.
+
+'''
+Classes for data preparation.
+
+'''
+
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from pytmge.core.crystal import extract_composition, CompositionMatrix
+from pytmge.core.crystal.chemical_formulas import canonicalize_formula
+from pytmge.core.plugins import Progress, get_n_jobs
+
+
+__author__ = 'Yang LIU'
+__maintainer__ = 'Yang LIU'
+__email__ = 'l_young@live.cn'
+__version__ = '1.0'
+__date__ = '2022/3/18'
+
+
+try:
+    from scipy.spatial import cKDTree
+    from scipy.spatial.distance import cdist
+except ImportError:  # scipy is optional, the distances fall back to numpy.
+    cKDTree = cdist = None
+
+
+def _get_composition(df_dataset):
+    # sparse composition, from a dataset or a CompositionMatrix.
+    if isinstance(df_dataset, CompositionMatrix):
+        return df_dataset
+    return extract_composition(df_dataset, sparse=True)
+
+
+def _manhattan_distances(c0, c1, block_size=2 ** 22):
+    '''
+    Manhattan distances between the rows of c0 and the rows of c1.
+
+    Parameters
+    ----------
+    c0, c1 : ndarray
+        dense composition, (formulas x elements), absent elements are 0.
+    block_size : int
+        max number of values in the temporary array of the numpy fallback.
+
+    Returns
+    -------
+    d : ndarray
+        (len(c0) x len(c1)).
+
+    '''
+
+    if cdist is not None:
+        return cdist(c0, c1, 'cityblock')
+
+    d = np.empty((c0.shape[0], c1.shape[0]))
+    step = max(block_size // max(c0.shape[0] * c0.shape[1], 1), 1)
+    for j in range(0, c1.shape[0], step):
+        d[:, j:j + step] = np.abs(c0[:, None, :] - c1[None, j:j + step, :]).sum(axis=2)
+    return d
+
+
+def _distances_within(c, out, condensed=False, n_jobs=1, block_size=2 ** 24):
+    '''
+    Filling out with the Manhattan distances between the rows of c,
+    block of rows by block of rows, in a pool of threads.
+    Only the upper triangle (j >= i) is computed.
+
+    Parameters
+    ----------
+    c : ndarray
+        dense composition, (formulas x elements), absent elements are 0.
+    out : ndarray
+        (formulas x formulas), or the condensed (formulas * (formulas - 1) / 2, ),
+        i.e. the upper triangle row by row, as scipy.spatial.distance.pdist.
+    condensed : bool
+        whether out is condensed.
+    n_jobs : int
+        number of threads, -1 means all CPUs.
+    block_size : int
+        max number of distances computed at once by each thread.
+
+    '''
+
+    n = c.shape[0]
+    n_jobs = get_n_jobs(n_jobs)
+    step = max(block_size // max(n, 1), 1)
+    starts = list(range(0, n, step))
+
+    def _offset(i):
+        # position of the distance (i, i + 1) in the condensed vector.
+        return i * n - i * (i + 1) // 2
+
+    def _fill(start):
+        end = min(start + step, n)
+        d = _manhattan_distances(c[start:end], c[start:])
+        if condensed:
+            is_upper = np.arange(n - start)[None, :] > np.arange(end - start)[:, None]
+            out[_offset(start):_offset(end)] = d[is_upper]
+        else:
+            out[start:end, start:] = d
+            out[start:, start:end] = d.T
+        return end
+
+    progress = Progress(n, 'computing distances')
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        for end in executor.map(_fill, starts):
+            progress.update(end)
+
+    return out
+
+
+class data_preparation:
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def delete_duplicates(df_dataset, canonicalize=False):
+        '''
+        Delete duplicate entries in dataset.
+
+        If two or more entries have the same chemical formula
+        but different property values, keep the entry having greater value (of the first column).
+
+        Parameters
+        ----------
+        df_dataset : DataFrame
+            dataset of chemical formula and target variable.
+            chemical formulas as index.
+        canonicalize : bool
+            if True, the chemical formulas having the same composition are considered the same,
+            e.g. 'Fe2O3', 'O3Fe2' and 'Fe2.0O3.0' (see canonicalize_formula).
+
+        Returns
+        -------
+        deduped_subset : DataFrame
+            deduped subset.
+
+        '''
+
+        print('\ndeleting duplicate entries in dataset ...')
+
+        if canonicalize:
+            keys = pd.Index([canonicalize_formula(cf) or cf for cf in df_dataset.index])
+        else:
+            keys = df_dataset.index
+
+        # sort the dataset by the values of first column (then the second column, and so on),
+        # so that the entry to keep is the last one of each chemical formula.
+        # empty values come first, they are never greater.
+        if df_dataset.shape[1] > 0:
+            order = df_dataset.reset_index(drop=True).sort_values(
+                by=list(df_dataset.columns), kind='mergesort', na_position='first'
+            ).index.to_numpy()
+        else:
+            order = np.arange(df_dataset.shape[0])
+        is_kept = ~keys[order].duplicated(keep='last')
+
+        df_deduped_subset = df_dataset.iloc[order[is_kept], :]
+
+        print('  original:', df_dataset.shape[0], '| deduped:', df_deduped_subset.shape[0])
+
+        df_deduped_subset = df_deduped_subset.sort_index(ascending=True)
+        # df_deduped_subset.sort_values(
+        #     by=list(df_deduped_subset.columns)[0],
+        #     ascending=False,
+        #     inplace=True
+        # )
+
+        return df_deduped_subset
+
+    @classmethod
+    def categorization_by_composition(cls, df_dataset, composition=None):
+        '''
+        Categorizing the chemical formulas,
+        according to 'number_of_elements', 'element', and 'elemental_contents' (n-e-c).
+
+        Parameters
+        ----------
+        df_dataset : DataFrame
+            dataset of chemical formula and target variable.
+            chemical formulas as index.
+        composition : CompositionMatrix or DataFrame, optional
+            composition of the dataset, if already extracted.
+
+        Returns
+        -------
+        dict_category : dict
+            dict_category, an inverted index of the categories,
+            {label: positions (as in df_dataset.iloc) of the entries}, in order of first appearance.
+
+        '''
+
+        print('\ncategorizing the chemical formulas ...')
+
+        if composition is None:
+            composition = extract_composition(df_dataset, sparse=True)
+        elif not isinstance(composition, CompositionMatrix):
+            composition = CompositionMatrix.from_dataframe(composition)
+
+        # composition of each entry of the dataset.
+        rows = pd.Index(composition.formulas).get_indexer(df_dataset.index)
+        positions = np.flatnonzero(rows >= 0)
+        entries = composition[rows[positions]]
+
+        # assign a category lable 'n-e-c' to each element having content >= 0.5,
+        # n: number of elements in each chemical formula, ignore the element(s) that content < 0.5.
+        is_labeled = entries.fraction >= 0.5
+        entry = entries.row_index()[is_labeled]
+        e = entries.element_index[is_labeled].astype('int64')
+        c = (entries.fraction[is_labeled] + 0.5).astype('int64')
+        n = np.bincount(entry, minlength=len(entries))[entry]
+
+        # group the entries by label.
+        codes = (n * len(composition.elements) + e) * (c.max(initial=0) + 1) + c
+        order = np.argsort(codes, kind='stable')
+        _, first = np.unique(codes[order], return_index=True)
+        groups = np.split(positions[entry[order]], first[1:])
+
+        dict_category = {}
+        for i in np.argsort(order[first], kind='stable'):
+            k = order[first[i]]
+            dict_category[str(n[k]) + '-' + composition.elements[e[k]] + '-' + str(c[k])] = groups[i]
+
+        return dict_category
+
+    @classmethod
+    def subset(cls, df_dataset, composition=None):
+        '''
+        Getting subset.
+        For each category, pick one entry having the highest value of material property.
+
+        Parameters
+        ----------
+        df_dataset : DataFrame
+            dataset of chemical formula and target variable.
+            chemical formulas as index.
+        composition : CompositionMatrix or DataFrame, optional
+            composition of the dataset, if already extracted.
+
+        Returns
+        -------
+        df_subset : DataFrame
+            df_subset.
+
+        '''
+
+        dict_category = cls.categorization_by_composition(df_dataset, composition=composition)
+        if not dict_category:
+            return df_dataset.iloc[:0, :]
+
+        positions = np.concatenate(list(dict_category.values()))
+        category = np.repeat(np.arange(len(dict_category)), [len(p) for p in dict_category.values()])
+
+        # in each category, the entry having the highest value (of the first column) comes first, empty values last.
+        rank = df_dataset.iloc[:, 0].rank(method='min', ascending=False, na_option='bottom').to_numpy()
+        order = np.lexsort((rank[positions], category))
+        is_highest = np.r_[True, category[order][1:] != category[order][:-1]]
+
+        df_subset = df_dataset.iloc[pd.unique(positions[order][is_highest]), :]
+        return df_subset
+
+    @staticmethod
+    def distances_within_dataset(df_dataset, condensed=False, dtype='float64', npy_path=None, n_jobs=1):
+        '''
+        Manhattan distances in composition space,
+        between each two chemical formulas in the dataset.
+
+        Parameters
+        ----------
+        df_dataset : DataFrame or CompositionMatrix
+            dataset of chemical formula and target variable.
+            chemical formulas as index.
+        condensed : bool
+            if True, only the upper triangle is returned, as a vector
+            (distance (i, j), i < j, at i * n - i * (i + 1) / 2 + j - i - 1, as scipy.spatial.distance.pdist),
+            with i, j the positions in extract_composition(df_dataset, sparse=True).formulas.
+        dtype : str
+            'float64' or 'float32'.
+        npy_path : str or Path, optional
+            if given, the distances are written to this memory-mapped .npy file,
+            which is returned, for the datasets whose distances do not fit in memory.
+        n_jobs : int
+            number of threads, -1 means all CPUs.
+
+        Returns
+        -------
+        df_distances : DataFrame or ndarray
+            df_distances.
+            chemical formulas as index and columns.
+            ndarray, if condensed or npy_path is given.
+
+        '''
+
+        composition = _get_composition(df_dataset)
+        cfs = composition.formulas
+        c = composition.to_dense()
+
+        shape = (len(cfs) * (len(cfs) - 1) // 2, ) if condensed else (len(cfs), len(cfs))
+        if npy_path is None:
+            distances = np.empty(shape, dtype=dtype)
+        else:
+            distances = np.lib.format.open_memmap(npy_path, mode='w+', dtype=dtype, shape=shape)
+
+        _distances_within(c, distances, condensed=condensed, n_jobs=n_jobs)
+
+        if condensed or npy_path is not None:
+            return distances
+
+        df_distances = pd.DataFrame(distances, index=cfs, columns=cfs, copy=False)
+
+        return df_distances
+
+    @staticmethod
+    def distances_between_datasets(df_dataset_0, df_dataset_1):
+        '''
+        Manhattan distances in composition space,
+        from each point in dataset_0 to the points in dataset_1.
+
+        Parameters
+        ----------
+        df_dataset_0 : DataFrame or CompositionMatrix
+            df_composition, derived from class 'dataset' .
+            chemical formulas as index, elements as columns.
+
+        df_dataset_1 : DataFrame or CompositionMatrix
+            df_composition, derived from class 'dataset' .
+            chemical formulas as index, elements as columns.
+
+        Returns
+        -------
+        df_distances : DataFrame
+            df_distances.
+            chemical formulas in dataset_0 as index.
+
+        '''
+
+        composition_0 = _get_composition(df_dataset_0)
+        composition_1 = _get_composition(df_dataset_1)
+        df_distances = pd.DataFrame(
+            _manhattan_distances(composition_0.to_dense(), composition_1.to_dense()),
+            index=composition_0.formulas, columns=composition_1.formulas
+        )
+
+        return df_distances
+
+    @staticmethod
+    def extrapolation_distance(df_dataset_train, df_dataset_test, ignore_duplicates=False, block_size=2 ** 22):
+        '''
+        Extrapolation distances (self-defined parameters, can be used in accessing the generalization ability of ML models),
+        i.e. the harmonic mean of the Manhattan distances in composition space
+        from each point in the test dataset to all the points in the training dataset,
+        and the harmonic mean of these over the test dataset.
+
+        The training dataset is streamed block by block, and the sums of 1/d are accumulated,
+        so the memory needed is proportional to the size of the test dataset.
+
+        Parameters
+        ----------
+        df_dataset_train : DataFrame or CompositionMatrix
+            training (reference) dataset, chemical formulas as index.
+        df_dataset_test : DataFrame or CompositionMatrix
+            test dataset, chemical formulas as index.
+        ignore_duplicates : bool
+            how to deal with zero distances, i.e. a test formula also in the training dataset.
+            False: its extrapolation distance is 0 (the limit of the harmonic mean), and so is the overall one.
+            True: the zero distances are left out of the harmonic means.
+        block_size : int
+            max number of distances computed at once.
+
+        Returns
+        -------
+        extrapolation_distances : Series
+            extrapolation distance of each test chemical formula.
+        extrapolation_distance : float
+            harmonic mean of extrapolation_distances.
+
+        '''
+
+        composition_train = _get_composition(df_dataset_train)
+        composition_test = _get_composition(df_dataset_test)
+        c_test = composition_test.to_dense()
+
+        inverse_sum = np.zeros(c_test.shape[0])
+        number_of_distances = np.zeros(c_test.shape[0])
+        number_of_zeros = np.zeros(c_test.shape[0])
+
+        step = max(block_size // max(c_test.shape[0], 1), 1)
+        n = len(composition_train)
+        progress = Progress(n, 'computing extrapolation distances')
+        for start in range(0, n, step):
+            d = _manhattan_distances(c_test, composition_train[start:start + step].to_dense())
+            is_zero = d == 0
+            inverse_sum += np.divide(1, d, out=np.zeros_like(d), where=~is_zero).sum(axis=1)
+            number_of_zeros += is_zero.sum(axis=1)
+            number_of_distances += d.shape[1]
+            progress.update(min(start + step, n))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if ignore_duplicates:
+                number_of_distances -= number_of_zeros
+                distances = np.where(inverse_sum > 0, number_of_distances / inverse_sum, np.nan)
+            else:
+                distances = np.where(number_of_zeros > 0, 0.0, number_of_distances / inverse_sum)
+
+        extrapolation_distances = pd.Series(distances, index=composition_test.formulas, name='distance')
+
+        is_valid = extrapolation_distances.notnull()
+        if not is_valid.any():
+            extrapolation_distance = np.nan
+        elif (extrapolation_distances[is_valid] == 0).any():
+            extrapolation_distance = 0.0
+        else:
+            extrapolation_distance = is_valid.sum() / np.sum(1 / extrapolation_distances[is_valid])
+
+        return extrapolation_distances, extrapolation_distance
+
+
+class CompositionIndex:
+    '''
+    Nearest-neighbor index over composition space,
+    for the Manhattan distances from chemical formulas to a (large) reference dataset,
+    without the full distance matrix.
+
+    A KD-tree (scipy.spatial.cKDTree, with p=1) is built over the elements present in the reference dataset only;
+    the contents of the other elements of a query add a constant to its distances.
+    Without scipy, the queries fall back to blocked brute-force distances.
+
+    '''
+
+    def __init__(self, df_dataset, leafsize=16):
+        '''
+        Parameters
+        ----------
+        df_dataset : DataFrame or CompositionMatrix
+            reference dataset, chemical formulas as index.
+        leafsize : int
+            leafsize of the KD-tree.
+
+        '''
+
+        composition = _get_composition(df_dataset)
+        c = composition.to_dense()
+
+        self.formulas = composition.formulas
+        self._elements = c.any(axis=0)  # elements present in the reference dataset.
+        self._c = c[:, self._elements]
+        self._tree = None if cKDTree is None else cKDTree(self._c, leafsize=leafsize)
+
+    def __len__(self):
+        return len(self.formulas)
+
+    def _project(self, df_dataset):
+        # query compositions on the elements of the index, and the distance offsets from the other elements.
+        composition = _get_composition(df_dataset)
+        c = composition.to_dense()
+        return composition.formulas, c[:, self._elements], c[:, ~self._elements].sum(axis=1)
+
+    def query(self, df_dataset, k=1, n_jobs=1, block_size=2 ** 22):
+        '''
+        k-nearest reference formulas of each chemical formula in df_dataset.
+
+        Parameters
+        ----------
+        df_dataset : DataFrame or CompositionMatrix
+            dataset of the query chemical formulas, chemical formulas as index.
+        k : int
+            number of nearest neighbors, at least 1 (at most the number of reference formulas).
+        n_jobs : int
+            number of threads, -1 means all CPUs.
+        block_size : int
+            max number of distances computed at once, without scipy.
+
+        Returns
+        -------
+        df_distances : DataFrame
+            distances to the k nearest neighbors, in ascending order.
+            query chemical formulas as index, 0 ... k-1 as columns.
+        df_neighbors : DataFrame
+            positions of the k nearest neighbors in self.formulas.
+
+        '''
+
+        if k < 1:
+            raise ValueError('k should be at least 1 : ' + repr(k))
+        if len(self.formulas) == 0:
+            raise ValueError('no reference chemical formula in the index.')
+
+        cfs, q, offsets = self._project(df_dataset)
+        k = min(k, len(self.formulas))
+
+        if self._tree is not None:
+            distances, neighbors = self._tree.query(q, k=list(range(1, k + 1)), p=1, workers=get_n_jobs(n_jobs))
+        else:
+            distances = np.empty((q.shape[0], k))
+            neighbors = np.empty((q.shape[0], k), dtype='int64')
+            step = max(block_size // max(len(self.formulas), 1), 1)
+            for start in range(0, q.shape[0], step):
+                d = _manhattan_distances(q[start:start + step], self._c)
+                nearest = np.argpartition(d, k - 1, axis=1)[:, :k]
+                d = np.take_along_axis(d, nearest, axis=1)
+                order = np.argsort(d, axis=1, kind='stable')
+                distances[start:start + step] = np.take_along_axis(d, order, axis=1)
+                neighbors[start:start + step] = np.take_along_axis(nearest, order, axis=1)
+
+        df_distances = pd.DataFrame(distances + offsets[:, None], index=cfs)
+        df_neighbors = pd.DataFrame(neighbors, index=cfs)
+
+        return df_distances, df_neighbors
+
+    def query_radius(self, df_dataset, r, n_jobs=1, block_size=2 ** 22):
+        '''
+        Reference formulas within the distance r of each chemical formula in df_dataset.
+
+        Parameters
+        ----------
+        df_dataset : DataFrame or CompositionMatrix
+            dataset of the query chemical formulas, chemical formulas as index.
+        r : float
+            radius, Manhattan distance.
+        n_jobs : int
+            number of threads, -1 means all CPUs.
+        block_size : int
+            max number of distances computed at once, without scipy.
+
+        Returns
+        -------
+        ds_neighbors : Series
+            positions (in self.formulas) of the neighbors of each query chemical formula.
+
+        '''
+
+        cfs, q, offsets = self._project(df_dataset)
+        radius = r - offsets  # negative when the other elements alone are farther than r.
+
+        if self._tree is not None:
+            neighbors = self._tree.query_ball_point(q, np.maximum(radius, 0), p=1, workers=get_n_jobs(n_jobs))
+            neighbors = [sorted(n) if rr >= 0 else [] for n, rr in zip(neighbors, radius)]
+        else:
+            neighbors = []
+            step = max(block_size // max(len(self.formulas), 1), 1)
+            for start in range(0, q.shape[0], step):
+                d = _manhattan_distances(q[start:start + step], self._c)
+                neighbors += [np.flatnonzero(_d <= rr).tolist() for _d, rr in zip(d, radius[start:start + step])]
+
+        ds_neighbors = pd.Series(neighbors, index=cfs, dtype='object')
+
+        return ds_neighbors
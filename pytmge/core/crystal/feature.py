@@ -1,211 +1,998 @@
-# coding: utf-8
-# Copyright (c) pytmge Development Team.
-
-"""
-Extracting features based on electron orbital attributes.
-
-"""
-
-
-import os
-import shutil
-import warnings
-import numpy as np
-import pandas as pd
-from pathlib import Path
-
-from pytmge.core import elemental_data
-from pytmge.core.crystal import extract_composition
-from pytmge.core.plugins import progressbar
-
-
-__author__ = 'Yang LIU'
-__maintainer__ = 'Yang LIU'
-__email__ = 'l_young@live.cn'
-__version__ = '1.0'
-__date__ = '2022/3/18'
-
-
-class feature_design:
-    '''
-    Extracting features based on electron orbital attributes.
-
-    '''
-
-    def __init__(self):
-        self._elemental_attribute_format = '[attribute].[shell_selection].[math operator 1]'
-        self._feature_format = '[attribute].[shell_selection].[math operator 1].[math operator 2]'
-
-    @staticmethod
-    def delete_unusable_features(df_features):
-        '''
-        Delete the features having empty value(s)
-        and the features being of zero variance.
-
-        Parameters
-        ----------
-        df_features : DataFrame
-            features.
-
-        Returns
-        -------
-        df_usable_features : DataFrame
-            usable_features.
-
-        '''
-
-        print('deleting unusable features')
-        features_variance = np.var(df_features, axis=0)
-        df_usable_features = df_features.loc[:, features_variance != 0] * 1
-
-        # df_usable_features.to_csv(str(Path(__file__).absolute().parent) + '\\' + 'usable_feature_variables.csv')
-
-        print(df_usable_features.shape[0], 'entries', df_usable_features.shape[1], 'usable features')
-
-        return df_usable_features
-
-    @classmethod
-    def get_features(self, df_dataset):
-        '''
-        Extracting features.
-
-        Parameters
-        ----------
-        df_dataset : DataFrame
-            chemical formulas as index.
-
-        Returns
-        -------
-        df_features : DataFrame
-            features.
-
-        '''
-
-        df_composition = extract_composition(df_dataset)
-        df_orbital_attributes_of_elements = elemental_data.orbital_attributes_of_elements
-
-        # # Lite edition
-        # _ea = df_orbital_attributes_of_elements.loc[
-        #     [
-        #         'E' in col_name
-        #         and 'range' in col_name
-        #         for col_name in list(df_orbital_attributes_of_elements.index)
-        #     ], :
-        # ]
-        # df_orbital_attributes_of_elements = _ea * 1
-        # #
-
-        print(df_orbital_attributes_of_elements.shape[0], 'attributes,', df_composition.shape[0], 'entries.')
-
-        cache_path = str(Path(__file__).absolute().parent) + '\\' + '_cache\\'
-        if os.path.exists(cache_path):
-            shutil.rmtree(cache_path)
-        os.makedirs(cache_path)
-
-        chemical_formula_list = list(df_composition.index)
-        elements_existence = (df_composition.notnull() * 1).replace(0, np.nan)
-
-        math_operators = {
-            'sum': 'sum(x)',
-            'avg': 'sum(x)/N',
-            'wavg': 'sum(w*x)/sum(w)',
-            'max': 'max(x)',
-            'min': 'min(x)',
-            'range': 'max(x)-min(x)',
-            'std': '(sum((x-wavg)**2)/N)**(1/2)'
-        }
-
-        warnings.filterwarnings('ignore')
-
-        n = 0
-        for a in list(df_orbital_attributes_of_elements.index):
-
-            ea = df_orbital_attributes_of_elements.loc[a, :] * 1
-            features = {}
-            for o in math_operators.keys():
-                features[a + '.' + o] = {}
-            if ea.notnull().sum() == 0:
-                # when all atomic_attribute values are nan, their feature_variables should be nan, too.
-                for o in math_operators.keys():
-                    for cf in chemical_formula_list:
-                        features[a + '.' + o][cf] = np.nan
-            else:
-                for cf in chemical_formula_list:
-                    v = ea * elements_existence.loc[cf]
-                    w = df_composition.loc[cf]  # weightings
-                    wea = v * w
-
-                    # compound_wavg is nan if this atomic_attribute are_empty for all elements.
-                    # compound_wavg = [np.nansum(wea) / w.sum(), np.nan][wea.notnull().sum() == 0]
-                    compound_wavg = np.nansum(wea) / w.sum() if wea.notnull().sum() else np.nan
-
-                    # compound_sum is nan if this atomic_attribute are_empty for all elements.
-                    # compound_sum = [np.nansum(v), np.nan][v.notnull().sum() == 0]
-                    compound_sum = np.nansum(v) if v.notnull().sum() else np.nan
-
-                    features[a + '.max'][cf] = np.nanmax(v)
-                    features[a + '.min'][cf] = np.nanmin(v)
-                    features[a + '.range'][cf] = np.nanmax(v) - np.nanmin(v)
-                    features[a + '.std'][cf] = np.nanstd(v)
-                    features[a + '.avg'][cf] = np.nanmean(v)
-                    features[a + '.wavg'][cf] = compound_wavg
-                    features[a + '.sum'][cf] = compound_sum
-
-                    n += 1
-                    progressbar(n, df_composition.shape[0] * df_orbital_attributes_of_elements.shape[0])
-
-            _df_features = pd.DataFrame.from_dict(features, orient='columns', dtype='float64')
-            _df_features.to_csv(cache_path + 'feature_variables [' + a + '._].csv', float_format='%8f')
-
-        warnings.resetwarnings
-
-        # reload features
-        df_features = pd.DataFrame(dtype='float64')
-        file_list = os.listdir(cache_path)
-        n = 0
-        for i in file_list:
-            n += 1
-            progressbar(n, len(file_list))
-            if os.path.isfile(cache_path + i):
-                df_data = pd.read_csv(cache_path + i, index_col=0)
-                for feature_name in list(df_data.columns):
-                    df_features[feature_name] = df_data[feature_name] * 1
-
-        # df_features.to_csv(str(Path(__file__).absolute().parent) + '\\' + 'feature_variables.csv', float_format='%8f')
-
-        shutil.rmtree(cache_path)
-
-        return df_features
-
-
-#
-
-class feature_engineering:
-
-    @staticmethod
-    def get_correlation_matrix(df_features):
-        '''
-        Getting Pearson correlation matrix.
-
-        Parameters
-        ----------
-        df_features : DataFrame
-            df_features.
-
-        Returns
-        -------
-        df_correlation_matrix : DataFrame
-            df_correlation_matrix.
-
-        '''
-
-        df_correlation_matrix = pd.DataFrame(np.corrcoef(df_features, rowvar=0))
-        df_correlation_matrix.index = df_features.columns
-        df_correlation_matrix.columns = df_features.columns
-
-        return df_correlation_matrix
-
-    @staticmethod
-    def feature_selection_by_Pearson_correlation(df_features):
-        feature_subset = []
-        return feature_subset
+# coding: utf-8
+# Copyright (c) pytmge Development Team.
+
+"""
+Extracting features based on electron orbital attributes.
+
+"""
+
+
+from fnmatch import fnmatchcase
+from itertools import islice
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from pytmge.core import elemental_data, element_list, get_orbital_attributes_of_elements
+from pytmge.core.crystal import extract_composition, CompositionMatrix
+from pytmge.core.crystal.chemical_formulas import parse_formula
+from pytmge.core.crystal.feature_store import FeatureStore
+from pytmge.core.plugins import Progress, get_n_jobs
+
+
+__author__ = 'Yang LIU'
+__maintainer__ = 'Yang LIU'
+__email__ = 'l_young@live.cn'
+__version__ = '1.0'
+__date__ = '2022/3/18'
+
+
+_math_operators = {
+    'sum': 'sum(x)',
+    'avg': 'sum(x)/N',
+    'wavg': 'sum(w*x)/sum(w)',
+    'max': 'max(x)',
+    'min': 'min(x)',
+    'range': 'max(x)-min(x)',
+    'std': '(sum((x-wavg)**2)/N)**(1/2)'
+}
+
+
+def _operate(v, w, operators=None):
+    '''
+    Applying the math operators to the gathered elemental attributes.
+
+    Parameters
+    ----------
+    v : ndarray
+        (formulas x k x attributes) elemental attributes of the present elements, nan for the padding.
+    w : ndarray
+        (formulas x k) contents of the present elements, 0 for the padding.
+    operators : list, optional
+        names of the math operators to apply, default is all of _math_operators.
+
+    Returns
+    -------
+    f : ndarray
+        (formulas x features), the operators of each attribute in a row.
+
+    '''
+
+    operators = list(_math_operators) if operators is None else operators
+    w = w[:, :, None]
+    is_nan = np.isnan(v)
+    count = (~is_nan).sum(axis=1)
+    is_empty = count == 0  # this attribute is empty for all elements of a formula.
+
+    # all-nan slices give nan, as the element-wise loop did.
+    # np.errstate, not warnings.catch_warnings, which is not thread-safe.
+    with np.errstate(invalid='ignore', divide='ignore'):
+
+        _sum = np.where(is_nan, 0, v).sum(axis=1)
+        _avg = _sum / count if {'avg', 'std'} & set(operators) else None
+        _max = np.fmax.reduce(v, axis=1) if {'max', 'range'} & set(operators) else None
+        _min = np.fmin.reduce(v, axis=1) if {'min', 'range'} & set(operators) else None
+        f = np.empty((v.shape[0], v.shape[2], len(operators)))
+        for i, operator in enumerate(operators):
+            if operator == 'sum':
+                f[:, :, i] = np.where(is_empty, np.nan, _sum)
+            elif operator == 'avg':
+                f[:, :, i] = _avg
+            elif operator == 'wavg':
+                f[:, :, i] = np.where(is_empty, np.nan, np.nansum(v * w, axis=1) / w.sum(axis=1))
+            elif operator == 'max':
+                f[:, :, i] = _max
+            elif operator == 'min':
+                f[:, :, i] = _min
+            elif operator == 'range':
+                f[:, :, i] = _max - _min
+            elif operator == 'std':
+                deviation = np.where(is_nan, 0, v - _avg[:, None, :])
+                f[:, :, i] = np.sqrt((deviation * deviation).sum(axis=1) / count)
+
+    return f.reshape(v.shape[0], -1)
+
+
+def _attach_array(spec):
+    kind, name, shape, dtype, offset = spec
+    if kind == 'memmap':
+        return np.memmap(name, mode='r+', shape=shape, dtype=dtype, offset=offset), None
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+def _compute_block(attribute_spec, out_spec, start, element_index, weights, operators, columns, dtype):
+    # the block is written to the memory-mapped out if any, else returned in dtype.
+    # the shared arrays are attached for the block only, so that an idle pool holds none of them.
+    attribute_matrix, attribute_shm = _attach_array(attribute_spec)
+    try:
+        f = _operate(attribute_matrix[element_index], weights, operators)
+    finally:
+        attribute_matrix = None
+        attribute_shm.close()
+    f = f if columns is None else f[:, columns]
+    if out_spec is None:
+        return f.astype(dtype, copy=False)
+    out, _ = _attach_array(out_spec)
+    out[start:start + element_index.shape[0]] = f
+    out.flush()
+
+
+def _compute_features(composition, df_elemental_attributes, out=None, n_jobs=1, block_size=2 ** 22,
+                      operators=None, columns=None, deduplicate=True, executor=None, report_progress=True):
+    '''
+    Computing the features of all formulas for all elemental attributes,
+    as batched array operations over blocks of formulas.
+
+    Parameters
+    ----------
+    composition : CompositionMatrix
+        composition.
+    df_elemental_attributes : DataFrame
+        elemental attributes, attributes as index, elements as columns.
+    out : ndarray, optional
+        (formulas x features) array to be filled, e.g. a memory-mapped file.
+    n_jobs : int
+        number of processes, -1 means all CPUs.
+        The attribute matrix and the output are shared with the processes,
+        through shared memory (or the memory-mapped file of out).
+    block_size : int
+        max number of values gathered at once, i.e. formulas x k x attributes.
+    operators : list, optional
+        names of the math operators to apply, default is all of _math_operators.
+    columns : ndarray, optional
+        positions of the features to keep, among _feature_names(attributes, operators).
+    deduplicate : bool
+        whether to compute the features once for each unique composition, then copy them to the formulas.
+        All the math operators depend only on the elements and their fractions, not on the scale of the contents
+        (sum, avg, max, min, range and std are of the elemental attributes, unweighted,
+        and wavg is weighted by the contents divided by their sum),
+        so e.g. 'Y1Ba2Cu3O7' and 'Y2Ba4Cu6O14' share their features.
+    executor : ProcessPoolExecutor, optional
+        pool of n_jobs processes to run the blocks, reused across calls instead of starting one each call.
+    report_progress : bool
+        whether to report the progress (see plugins.set_progress).
+
+    Returns
+    -------
+    features : ndarray
+        (formulas x features), features named by _feature_names(attributes, operators)[columns].
+
+    '''
+
+    if deduplicate:
+        unique_composition, inverse = composition.unique(normalize=True)
+        if len(unique_composition) < len(composition):
+            return _compute_deduplicated_features(
+                unique_composition, inverse, df_elemental_attributes, out, n_jobs, block_size,
+                operators, columns, executor
+            )
+
+    # one extra empty row for the padded positions.
+    attribute_matrix = df_elemental_attributes.reindex(columns=composition.elements).to_numpy(dtype='float64').T
+    attribute_matrix = np.vstack([attribute_matrix, np.full((1, attribute_matrix.shape[1]), np.nan)])
+
+    element_index, weights = composition.compact()
+    n, k = element_index.shape
+    if out is None:
+        n_features = attribute_matrix.shape[1] * len(_math_operators if operators is None else operators)
+        out = np.empty((n, n_features if columns is None else len(columns)), dtype='float64')
+    n_jobs = get_n_jobs(n_jobs)
+    step = max(block_size // (k * attribute_matrix.shape[1]), 1)
+    if n_jobs > 1:
+        # at least 4 blocks per worker, so that none of them is idle.
+        step = min(step, max(-(-n // (4 * n_jobs)), 1))
+    starts = list(range(0, n, step))
+
+    n_jobs = min(n_jobs, len(starts))
+    progress = Progress(n, 'computing features') if report_progress else None
+    if n_jobs <= 1:
+        for start in starts:
+            end = min(start + step, n)
+            f = _operate(attribute_matrix[element_index[start:end]], weights[start:end], operators)
+            out[start:end] = f if columns is None else f[:, columns]
+            if progress is not None:
+                progress.update(end)
+        return out
+
+    attribute_shm = shared_memory.SharedMemory(create=True, size=attribute_matrix.nbytes)
+    try:
+        np.ndarray(attribute_matrix.shape, dtype=attribute_matrix.dtype, buffer=attribute_shm.buf)[:] = attribute_matrix
+        attribute_spec = ('shm', attribute_shm.name, attribute_matrix.shape, attribute_matrix.dtype, 0)
+
+        if isinstance(out, np.memmap):
+            # the workers write to the file directly.
+            out.flush()
+            out_spec = ('memmap', out.filename, out.shape, out.dtype, out.offset)
+        else:
+            # the workers return their blocks, copied to out as they come,
+            # with at most 2 blocks per worker in flight, so that no second out is needed.
+            out_spec = None
+
+        pool = ProcessPoolExecutor(n_jobs) if executor is None else executor
+        pending = {}
+        try:
+            remaining = iter(starts)
+
+            def submit(n_blocks):
+                for start in islice(remaining, n_blocks):
+                    future = pool.submit(
+                        _compute_block, attribute_spec, out_spec, start,
+                        element_index[start:start + step], weights[start:start + step], operators, columns, out.dtype
+                    )
+                    pending[future] = start
+
+            submit(2 * n_jobs)
+            done = 0
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    start = pending.pop(future)
+                    f = future.result()
+                    if f is not None:
+                        out[start:start + f.shape[0]] = f
+                    done += min(step, n - start)
+                    if progress is not None:
+                        progress.update(done)
+                finished = f = None  # releasing the blocks copied.
+                submit(2 * n_jobs - len(pending))
+        finally:
+            for future in pending:
+                future.cancel()
+            if pool is not executor:
+                pool.shutdown()
+    finally:
+        attribute_shm.close()
+        attribute_shm.unlink()
+
+    return out
+
+
+def _compute_deduplicated_features(unique_composition, inverse, df_elemental_attributes, out, n_jobs, block_size,
+                                   operators, columns, executor):
+    # computing the features of the unique compositions a block at a time, each block copied at once
+    # to the rows of its formulas in out, so that only a block of them is held in memory
+    # (out may be float32 or a memory-mapped file).
+    n_features = df_elemental_attributes.shape[0] * len(_math_operators if operators is None else operators)
+    n_features = n_features if columns is None else len(columns)
+    if out is None:
+        out = np.empty((len(inverse), n_features), dtype='float64')
+
+    # the rows of the formulas of each unique composition.
+    rows = np.argsort(inverse, kind='stable')
+    bounds = np.searchsorted(inverse[rows], np.arange(len(unique_composition) + 1))
+
+    n_jobs = get_n_jobs(n_jobs)
+    step = max(block_size // max(n_features, 1), 1) * n_jobs
+    pool = ProcessPoolExecutor(n_jobs) if executor is None and n_jobs > 1 else executor
+    progress = Progress(len(inverse), 'computing features')
+    try:
+        for start in range(0, len(unique_composition), step):
+            end = min(start + step, len(unique_composition))
+            f = _compute_features(
+                unique_composition[start:end], df_elemental_attributes, n_jobs=n_jobs, block_size=block_size,
+                operators=operators, columns=columns, deduplicate=False, executor=pool, report_progress=False
+            )
+            rows_of_block = np.sort(rows[bounds[start]:bounds[end]])
+            out[rows_of_block] = f[inverse[rows_of_block] - start]
+            progress.update(bounds[end])
+    finally:
+        if pool is not executor:
+            pool.shutdown()
+
+    return out
+
+
+def _feature_names(attributes, operators=None):
+    '''
+    Feature names, [attribute].[shell_selection].[math operator 1].[math operator 2],
+    in the column order of _compute_features().
+
+    '''
+    operators = list(_math_operators) if operators is None else operators
+    return [a + '.' + o for a in attributes for o in operators]
+
+
+def _select_features(feature_names, features):
+    '''
+    Selecting features by names or patterns.
+
+    Parameters
+    ----------
+    feature_names : list
+        all the feature names.
+    features : str or list
+        a feature name or a pattern ('*' for any characters), e.g. 'E.*.*.range',
+        or a list of them.
+
+    Returns
+    -------
+    selected_feature_names : list
+        in the order of the list, then in the order of feature_names for each pattern.
+
+    '''
+
+    patterns = [features] if isinstance(features, str) else list(features)
+    known_feature_names = set(feature_names)
+    selected_feature_names = {}
+    for pattern in patterns:
+        if pattern in known_feature_names:
+            matches = [pattern]
+        else:
+            matches = [name for name in feature_names if fnmatchcase(name, pattern)]
+        if not matches:
+            raise ValueError('no feature matches ' + repr(pattern))
+        selected_feature_names.update(dict.fromkeys(matches))
+
+    return list(selected_feature_names)
+
+
+def _plan_features(energy_threshold=None, df_elemental_attributes=None, features=None):
+    '''
+    The elemental attributes and math operators needed for the features,
+    see feature_design.get_features() for the parameters.
+
+    Returns
+    -------
+    df_orbital_attributes_of_elements : DataFrame
+        the elemental attributes needed, attributes as index, elements as columns.
+    feature_names : list
+        names of the features.
+    operators : list or None
+        names of the math operators needed, None for all.
+    columns : ndarray or None
+        positions of the features among those computed, None for all.
+
+    '''
+
+    if df_elemental_attributes is not None:
+        df_orbital_attributes_of_elements = df_elemental_attributes
+    elif energy_threshold is not None:
+        df_orbital_attributes_of_elements = get_orbital_attributes_of_elements(energy_threshold)
+    else:
+        df_orbital_attributes_of_elements = elemental_data.orbital_attributes_of_elements
+
+    # the attributes in alphabetical order, as the features used to be reloaded from the '_cache' directory.
+    df_orbital_attributes_of_elements = df_orbital_attributes_of_elements.loc[
+        sorted(df_orbital_attributes_of_elements.index, key=str.lower), :
+    ]
+
+    feature_names = _feature_names(df_orbital_attributes_of_elements.index)
+    operators = None
+    columns = None
+    if features is not None:
+        # only the attributes and math operators of the selected features.
+        feature_names = _select_features(feature_names, features)
+        attributes = list(dict.fromkeys(name.rsplit('.', 1)[0] for name in feature_names))
+        operators = [o for o in _math_operators if o in {name.rsplit('.', 1)[1] for name in feature_names}]
+        df_orbital_attributes_of_elements = df_orbital_attributes_of_elements.loc[attributes, :]
+        computed_feature_names = _feature_names(attributes, operators)
+        if computed_feature_names != feature_names:
+            positions = {name: i for i, name in enumerate(computed_feature_names)}
+            columns = np.array([positions[name] for name in feature_names])
+
+    return df_orbital_attributes_of_elements, feature_names, operators, columns
+
+
+def _iter_chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, chunk_size))
+
+
+class VarianceFilter:
+    '''
+    Finding the usable features, chunk by chunk of entries,
+    e.g. as they are produced by feature_design.iter_features(),
+    without holding all the features in memory.
+
+    The mean and variance of each feature are updated with each chunk (Welford / Chan et al.),
+    over its non-empty values, along with the number of empty values and the min and max.
+    A feature is usable if it has non-empty values, and they are not all the same.
+
+    '''
+
+    def __init__(self):
+        self.columns = None
+        self.count = None  # number of non-empty values.
+        self.number_of_empty = None
+        self.mean = None
+        self._m2 = None  # sum of squared deviations from the mean.
+        self.min = None
+        self.max = None
+
+    def update(self, df_chunk):
+        '''
+        Parameters
+        ----------
+        df_chunk : DataFrame
+            features of a chunk of entries, possibly none.
+
+        '''
+
+        x = df_chunk.to_numpy(dtype='float64')
+        is_empty = np.isnan(x)
+        count = (~is_empty).sum(axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(is_empty, 0, x).sum(axis=0) / count
+            deviation = np.where(is_empty, 0, x - mean)
+            m2 = (deviation * deviation).sum(axis=0)
+            # nan for the features all empty in the chunk, or when the chunk has no entry.
+            _min = np.fmin.reduce(x, axis=0, initial=np.nan)
+            _max = np.fmax.reduce(x, axis=0, initial=np.nan)
+
+        if self.columns is None:
+            self.columns = df_chunk.columns
+            self.count = count
+            self.number_of_empty = is_empty.sum(axis=0)
+            self.mean = np.where(count > 0, mean, 0)
+            self._m2 = m2
+            self.min = _min
+            self.max = _max
+            return self
+
+        # merging the moments of the chunk with the previous ones.
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(count > 0, mean - self.mean, 0)
+            ratio = np.where(total > 0, count / total, 0)
+        self.mean = self.mean + delta * ratio
+        self._m2 = self._m2 + m2 + delta * delta * self.count * ratio
+        self.count = total
+        self.number_of_empty = self.number_of_empty + is_empty.sum(axis=0)
+        self.min = np.fmin(self.min, _min)
+        self.max = np.fmax(self.max, _max)
+
+        return self
+
+    @property
+    def variance(self):
+        # population variance of the non-empty values, nan for the empty features.
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return pd.Series(np.where(self.count > 0, self._m2 / self.count, np.nan), index=self.columns)
+
+    def get_usable_mask(self):
+        '''
+        Returns
+        -------
+        is_usable : Series
+            bool of each feature, False for the features all empty or of zero variance.
+
+        '''
+
+        # comparing the min and max, as a constant feature may have a tiny non-zero variance by rounding.
+        return pd.Series((self.count > 0) & (self.max > self.min), index=self.columns)
+
+
+class feature_design:
+    '''
+    Extracting features based on electron orbital attributes.
+
+    '''
+
+    def __init__(self):
+        self._elemental_attribute_format = '[attribute].[shell_selection].[math operator 1]'
+        self._feature_format = '[attribute].[shell_selection].[math operator 1].[math operator 2]'
+
+    @staticmethod
+    def delete_unusable_features(df_features, chunk_size=2 ** 16):
+        '''
+        Delete the features having only empty values
+        and the features being of zero variance.
+        See VarianceFilter to find them chunk by chunk, e.g. with iter_features().
+
+        Parameters
+        ----------
+        df_features : DataFrame
+            features.
+        chunk_size : int
+            number of entries read at once.
+
+        Returns
+        -------
+        df_usable_features : DataFrame
+            usable_features.
+
+        '''
+
+        print('deleting unusable features')
+        variance_filter = VarianceFilter()
+        for start in range(0, max(df_features.shape[0], 1), chunk_size):
+            variance_filter.update(df_features.iloc[start:start + chunk_size, :])
+        df_usable_features = df_features.loc[:, variance_filter.get_usable_mask().to_numpy()]
+
+        # df_usable_features.to_csv(str(Path(__file__).absolute().parent) + '\\' + 'usable_feature_variables.csv')
+
+        print(df_usable_features.shape[0], 'entries', df_usable_features.shape[1], 'usable features')
+
+        return df_usable_features
+
+    @staticmethod
+    def load_features(spill_path):
+        '''
+        Loading the features spilled to disk by get_features().
+
+        Parameters
+        ----------
+        spill_path : str or Path
+            directory of 'features.npy' and 'labels.npz'.
+
+        Returns
+        -------
+        df_features : DataFrame
+            features, backed by a read-only memory-mapped array.
+
+        '''
+
+        spill_path = Path(spill_path)
+        labels = np.load(spill_path / 'labels.npz')
+        features = np.load(spill_path / 'features.npy', mmap_mode='r')
+        df_features = pd.DataFrame(features, index=list(labels['index']), columns=list(labels['columns']), copy=False)
+        if 'version' in labels.files:
+            df_features.attrs['version'] = str(labels['version'])
+
+        return df_features
+
+    @classmethod
+    def update_features(self, df_features, df_dataset, dtype=None, n_jobs=1,
+                        energy_threshold=None, df_elemental_attributes=None, executor=None):
+        '''
+        Updating a feature table for a new version of the dataset,
+        only the features of the new chemical formulas are computed,
+        the others are taken from df_features if it is of the same version
+        (the same elemental attributes and features, see df_features.attrs['version']).
+        For the features in a FeatureStore, use get_features(df_dataset, store=...) instead.
+
+        Parameters
+        ----------
+        df_features : DataFrame
+            features, as returned by get_features() or load_features().
+        df_dataset : DataFrame or CompositionMatrix
+            chemical formulas as index, or their composition.
+        dtype : str, optional
+            default is that of df_features.
+        n_jobs : int
+            number of processes, -1 means all CPUs.
+        energy_threshold : float, optional
+            see get_features().
+        df_elemental_attributes : DataFrame, optional
+            see get_features().
+        executor : ProcessPoolExecutor, optional
+            see get_features().
+
+        Returns
+        -------
+        df_features : DataFrame
+            features of the chemical formulas of df_dataset, with the columns of df_features.
+
+        '''
+
+        if isinstance(df_dataset, CompositionMatrix):
+            composition = df_dataset
+        else:
+            composition = extract_composition(df_dataset, n_jobs=n_jobs, sparse=True, executor=executor)
+
+        df_orbital_attributes_of_elements, feature_names, operators, columns = _plan_features(
+            energy_threshold, df_elemental_attributes, list(df_features.columns)
+        )
+        version = FeatureStore.get_version(df_orbital_attributes_of_elements, feature_names)
+        dtype = (df_features.dtypes.iloc[0] if df_features.shape[1] > 0 else 'float64') if dtype is None else dtype
+
+        # positions of the chemical formulas in df_features, -1 if not there.
+        if df_features.attrs.get('version') == version:
+            is_last = ~df_features.index.duplicated(keep='last')
+            indexer = df_features.index[is_last].get_indexer(composition.formulas)
+            positions = np.where(indexer >= 0, np.flatnonzero(is_last)[indexer], -1)
+        else:
+            print('the version of the features has changed, all of them are computed.')
+            positions = np.full(len(composition), -1)
+
+        missing = np.flatnonzero(positions < 0)
+        print(len(composition) - len(missing), 'entries kept,', len(missing), 'entries computed.')
+
+        feature_array = np.empty((len(composition), len(feature_names)), dtype=dtype)
+        kept = np.flatnonzero(positions >= 0)
+        feature_array[kept] = df_features.to_numpy()[positions[kept]]
+        if len(missing) > 0:
+            feature_array[missing] = _compute_features(
+                composition[missing], df_orbital_attributes_of_elements, n_jobs=n_jobs,
+                operators=operators, columns=columns, executor=executor
+            )
+
+        df_updated_features = pd.DataFrame(feature_array, index=composition.formulas, columns=feature_names, copy=False)
+        df_updated_features.attrs['version'] = version
+
+        return df_updated_features
+
+    @classmethod
+    def get_features(self, df_dataset, dtype='float64', spill_path=None, n_jobs=1,
+                     energy_threshold=None, df_elemental_attributes=None, features=None, store=None,
+                     executor=None):
+        '''
+        Extracting features.
+
+        For a sweep over energy_threshold, extract the composition once
+        (extract_composition(df_dataset, sparse=True)) and pass it as df_dataset,
+        then only the elemental attributes and the features are recomputed.
+
+        Parameters
+        ----------
+        df_dataset : DataFrame or CompositionMatrix
+            chemical formulas as index, or their composition.
+        dtype : str
+            'float64' or 'float32'.
+        spill_path : str or Path, optional
+            a directory, if given, the features are written to 'features.npy' in it
+            (with 'labels.npz' of formulas and feature names) and memory-mapped,
+            for the datasets whose features do not fit in memory.
+        n_jobs : int
+            number of processes, -1 means all CPUs.
+        energy_threshold : float, optional
+            the shells in [0, energy_threshold] (eV) are considered as valence shells,
+            default is that of elemental_data.orbital_attributes_of_elements (-36 eV).
+        df_elemental_attributes : DataFrame, optional
+            precomputed elemental attributes (attributes as index, elements as columns),
+            e.g. from get_orbital_attributes_of_elements(), instead of energy_threshold.
+        features : str or list, optional
+            the features to compute, named [attribute].[shell_selection].[math operator 1].[math operator 2],
+            a name or a pattern ('*' for any characters), or a list of them,
+            e.g. 'E.*.range.*' (the Lite edition) or the features used by a model.
+            Only the attributes and math operators needed are computed.
+            Default is all the features.
+        store : FeatureStore, str or Path, optional
+            a feature store (or the path of its database), if given,
+            the features of the formulas found in it are not computed again,
+            and the computed ones are added to it.
+        executor : ProcessPoolExecutor, optional
+            pool of n_jobs processes to reuse across calls, instead of starting one in each call.
+
+        Returns
+        -------
+        df_features : DataFrame
+            features.
+
+        '''
+
+        if isinstance(df_dataset, CompositionMatrix):
+            composition = df_dataset
+        else:
+            composition = extract_composition(df_dataset, n_jobs=n_jobs, sparse=True, executor=executor)
+
+        df_orbital_attributes_of_elements, feature_names, operators, columns = _plan_features(
+            energy_threshold, df_elemental_attributes, features
+        )
+        # the version of the features, kept in df_features.attrs for update_features().
+        version = FeatureStore.get_version(df_orbital_attributes_of_elements, feature_names)
+
+        print(df_orbital_attributes_of_elements.shape[0], 'attributes,', len(composition), 'entries.')
+
+        chemical_formula_list = composition.formulas
+
+        if spill_path is None:
+            feature_array = np.empty((len(chemical_formula_list), len(feature_names)), dtype=dtype)
+        else:
+            # write the features to disk instead of holding them in memory.
+            spill_path = Path(spill_path)
+            spill_path.mkdir(parents=True, exist_ok=True)
+            np.savez(
+                spill_path / 'labels.npz',
+                index=np.array(chemical_formula_list, dtype=str),
+                columns=np.array(feature_names, dtype=str),
+                version=np.array(version)
+            )
+            feature_array = np.lib.format.open_memmap(
+                spill_path / 'features.npy', mode='w+', dtype=dtype,
+                shape=(len(chemical_formula_list), len(feature_names))
+            )
+
+        if store is None:
+            _compute_features(
+                composition, df_orbital_attributes_of_elements, out=feature_array, n_jobs=n_jobs,
+                operators=operators, columns=columns, executor=executor
+            )
+        else:
+            # only the features not in the store are computed.
+            store = store if isinstance(store, FeatureStore) else FeatureStore(store)
+            keys = composition.canonical_formulas()
+            is_stored = store.get(keys, version, out=feature_array)
+            missing = np.flatnonzero(~is_stored)
+            print(len(keys) - len(missing), 'entries found in the feature store.')
+            if len(missing) > 0:
+                missing_features = _compute_features(
+                    composition[missing], df_orbital_attributes_of_elements, n_jobs=n_jobs,
+                    operators=operators, columns=columns, executor=executor
+                )
+                feature_array[missing] = missing_features
+                store.put([keys[i] for i in missing], version, missing_features)
+
+        if spill_path is not None:
+            feature_array.flush()
+            del feature_array
+            return self.load_features(spill_path)
+
+        df_features = pd.DataFrame(feature_array, index=chemical_formula_list, columns=feature_names, copy=False)
+        df_features.attrs['version'] = version
+
+        # df_features.to_csv(str(Path(__file__).absolute().parent) + '\\' + 'feature_variables.csv', float_format='%8f')
+
+        return df_features
+
+    @classmethod
+    def iter_features(self, source, chunk_size=10000, dtype='float64', output=None, n_jobs=1,
+                      energy_threshold=None, df_elemental_attributes=None, features=None, store=None,
+                      executor=None):
+        '''
+        Extracting features chunk by chunk,
+        so that the memory needed does not grow with the size of the dataset.
+
+        Parameters
+        ----------
+        source : str, Path, DataFrame or iterable
+            a csv file (chemical formulas in the first column),
+            a dataset (chemical formulas as index),
+            or an iterable of chemical formulas.
+        chunk_size : int
+            number of chemical formulas in each chunk.
+        dtype : str
+            'float64' or 'float32'.
+        output : str or Path, optional
+            a csv file, if given, each chunk of features is appended to it.
+        n_jobs : int
+            number of processes for each chunk, -1 means all CPUs.
+        energy_threshold : float, optional
+            see get_features().
+        df_elemental_attributes : DataFrame, optional
+            see get_features().
+        features : str or list, optional
+            see get_features().
+        store : FeatureStore, str or Path, optional
+            see get_features().
+        executor : ProcessPoolExecutor, optional
+            see get_features(), by default one pool of n_jobs processes serves all the chunks.
+
+        Yields
+        ------
+        df_features : DataFrame
+            features of a chunk.
+
+        '''
+
+        if isinstance(source, (str, Path)):
+            chunks = pd.read_csv(source, index_col=0, chunksize=chunk_size)
+        elif isinstance(source, pd.DataFrame):
+            chunks = (source.iloc[i:i + chunk_size, :] for i in range(0, source.shape[0], chunk_size))
+        else:
+            chunks = (pd.DataFrame(index=cfs) for cfs in _iter_chunks(source, chunk_size))
+
+        n_jobs = get_n_jobs(n_jobs)
+        pool = ProcessPoolExecutor(n_jobs) if executor is None and n_jobs > 1 else executor
+        try:
+            is_first_chunk = True
+            for df_chunk in chunks:
+                df_features = self.get_features(
+                    df_chunk, dtype=dtype, n_jobs=n_jobs,
+                    energy_threshold=energy_threshold, df_elemental_attributes=df_elemental_attributes,
+                    features=features, store=store, executor=pool
+                )
+                if output is not None:
+                    df_features.to_csv(output, mode='w' if is_first_chunk else 'a', header=is_first_chunk)
+                is_first_chunk = False
+                yield df_features
+        finally:
+            if pool is not executor:
+                pool.shutdown()
+
+
+class Featurizer:
+    '''
+    Extracting the features of chemical formulas directly,
+    with the elemental attributes loaded once, for online serving.
+    No progress report, no DataFrame and no disk I/O per call.
+
+    Parameters
+    ----------
+    features : str or list, optional
+        see feature_design.get_features().
+    energy_threshold : float, optional
+        see feature_design.get_features().
+    df_elemental_attributes : DataFrame, optional
+        see feature_design.get_features().
+    dtype : str
+        'float64' or 'float32'.
+    block_size : int
+        max number of values gathered at once by featurize_many(), i.e. formulas x k x attributes.
+
+    '''
+
+    def __init__(self, features=None, energy_threshold=None, df_elemental_attributes=None,
+                 dtype='float64', block_size=2 ** 22):
+
+        df_orbital_attributes_of_elements, self.feature_names, self._operators, self._columns = _plan_features(
+            energy_threshold, df_elemental_attributes, features
+        )
+
+        # (elements x attributes) in the order of element_list, one extra empty row for the padded positions.
+        attribute_matrix = df_orbital_attributes_of_elements.reindex(columns=element_list).to_numpy(dtype='float64').T
+        self._attribute_matrix = np.vstack([attribute_matrix, np.full((1, attribute_matrix.shape[1]), np.nan)])
+        self._element_position = {e: i for i, e in enumerate(element_list)}
+        self._dtype = dtype
+        self._block_size = block_size
+
+    def _compact(self, composition):
+        # elements in the order of element_list, absent (zero content) elements dropped, as in CompositionMatrix.
+        composition = sorted((self._element_position[e], c) for e, c in composition if c != 0)
+        return [i for i, _ in composition], [c for _, c in composition]
+
+    def _operate(self, element_index, weights):
+        f = _operate(self._attribute_matrix[element_index], weights, self._operators)
+        f = f if self._columns is None else f[:, self._columns]
+        return f.astype(self._dtype, copy=False)
+
+    def featurize(self, formula):
+        '''
+        Parameters
+        ----------
+        formula : str
+            chemical formula, like 'H2O1'.
+
+        Returns
+        -------
+        features : ndarray
+            (features, ), named by feature_names.
+
+        '''
+
+        composition = parse_formula(formula)
+        if composition is None:
+            raise ValueError('chemical formula seems not right : ' + repr(formula))
+        element_index, weights = self._compact(composition)
+        if not element_index:
+            element_index, weights = [len(element_list)], [0.0]
+
+        return self._operate(np.array([element_index]), np.array([weights], dtype='float64'))[0]
+
+    def featurize_many(self, formulas):
+        '''
+        Parameters
+        ----------
+        formulas : list
+            chemical formulas.
+
+        Returns
+        -------
+        features : ndarray
+            (formulas x features), named by feature_names,
+            nan for the chemical formulas not in proper format.
+
+        '''
+
+        compositions = [parse_formula(cf) for cf in formulas]
+        compositions = [self._compact(c) if c is not None else ([], []) for c in compositions]
+        k = max([len(element_index) for element_index, _ in compositions] + [1])
+
+        element_index = np.full((len(compositions), k), len(element_list), dtype='int64')
+        weights = np.zeros((len(compositions), k))
+        for i, (_element_index, _weights) in enumerate(compositions):
+            element_index[i, :len(_element_index)] = _element_index
+            weights[i, :len(_weights)] = _weights
+
+        features = np.empty((len(compositions), len(self.feature_names)), dtype=self._dtype)
+        step = max(self._block_size // (k * self._attribute_matrix.shape[1]), 1)
+        for start in range(0, len(compositions), step):
+            features[start:start + step] = self._operate(
+                element_index[start:start + step], weights[start:start + step]
+            )
+
+        return features
+
+
+#
+
+class feature_engineering:
+
+    @staticmethod
+    def get_correlation_matrix(df_features):
+        '''
+        Getting Pearson correlation matrix.
+
+        Parameters
+        ----------
+        df_features : DataFrame
+            df_features.
+
+        Returns
+        -------
+        df_correlation_matrix : DataFrame
+            df_correlation_matrix.
+
+        '''
+
+        df_correlation_matrix = pd.DataFrame(np.corrcoef(df_features, rowvar=0))
+        df_correlation_matrix.index = df_features.columns
+        df_correlation_matrix.columns = df_features.columns
+
+        return df_correlation_matrix
+
+    @staticmethod
+    def _standardize(df_features, columns, dtype):
+        # standardized columns, divided by sqrt(N), so that Z.T @ Z is the correlation matrix.
+        # the empty values are replaced by the mean (0), the constant and empty columns are dropped.
+        x = np.array(df_features.iloc[:, columns], dtype=dtype)  # a copy, standardized in place.
+        columns = np.asarray(columns)
+        # comparing the min and max as in VarianceFilter.get_usable_mask(), before centering,
+        # as the mean of a constant column is not exactly the constant (in float32 above all).
+        with np.errstate(invalid='ignore'):
+            is_usable = np.fmax.reduce(x, axis=0, initial=np.nan) > np.fmin.reduce(x, axis=0, initial=np.nan)
+        x, columns = x[:, is_usable], columns[is_usable]
+        if len(columns) == 0:
+            return x, columns
+        is_nan = np.isnan(x)
+        mean = np.nanmean(x, axis=0) if is_nan.any() else x.mean(axis=0)
+        x -= mean
+        x[is_nan] = 0
+        std = np.sqrt((x * x).mean(axis=0))
+        z = x / (std * np.sqrt(x.shape[0], dtype=dtype))
+        return z, columns
+
+    @classmethod
+    def feature_selection_by_Pearson_correlation(cls, df_features, threshold=0.9, block_size=256, dtype='float32'):
+        '''
+        Selecting features, dropping those correlated to a selected one.
+
+        The features are considered in the order of the columns (put the preferred ones first),
+        a feature is selected if its absolute Pearson correlation coefficients
+        with all the selected features are below the threshold.
+        The columns are standardized block by block, and only correlated with the selected ones,
+        so the memory needed is that of the block and the selected features, not the correlation matrix.
+
+        Parameters
+        ----------
+        df_features : DataFrame
+            features, the empty values are replaced by the mean, the constant features are dropped.
+        threshold : float
+            max absolute correlation coefficient between the selected features.
+        block_size : int
+            number of features standardized and correlated at once.
+        dtype : str
+            'float32' or 'float64'.
+
+        Returns
+        -------
+        feature_subset : list
+            names of the selected features.
+
+        '''
+
+        selected_blocks = []  # standardized selected features, block by block.
+        selected_columns = []
+        for start in range(0, df_features.shape[1], block_size):
+            z, columns = cls._standardize(df_features, range(start, min(start + block_size, df_features.shape[1])), dtype)
+
+            # dropping the features correlated with those selected in the previous blocks.
+            is_candidate = np.ones(len(columns), dtype=bool)
+            for z_selected in selected_blocks:
+                candidates = np.flatnonzero(is_candidate)
+                c = z_selected.T @ z[:, candidates]
+                is_candidate[candidates[(np.abs(c) >= threshold).any(axis=0)]] = False
+                if not is_candidate.any():
+                    break
+
+            # then selecting greedily inside the block.
+            candidates = np.flatnonzero(is_candidate)
+            c = np.abs(z[:, candidates].T @ z[:, candidates]) >= threshold
+            is_selected = np.zeros(len(candidates), dtype=bool)
+            for i in range(len(candidates)):
+                is_selected[i] = not (c[i, :i] & is_selected[:i]).any()
+
+            if is_selected.any():
+                selected_blocks.append(z[:, candidates[is_selected]])
+                selected_columns += list(columns[candidates[is_selected]])
+
+        feature_subset = list(df_features.columns[selected_columns])
+
+        return feature_subset
@@ -0,0 +1,197 @@
+# coding: utf-8
+# Copyright (c) pytmge Development Team.
+
+"""
+Storing the features of chemical formulas on disk, to be reused across runs.
+
+"""
+
+
+import json
+import time
+import sqlite3
+import hashlib
+import numpy as np
+from pathlib import Path
+from contextlib import closing
+
+from pytmge.core.plugins import get_cache_dir
+
+
+__author__ = 'Yang LIU'
+__maintainer__ = 'Yang LIU'
+__email__ = 'l_young@live.cn'
+__version__ = '1.0'
+__date__ = '2022/3/18'
+
+
+class FeatureStore:
+    '''
+    Features of chemical formulas in a SQLite database,
+    keyed by canonical chemical formula and the version of the attribute table (see get_version),
+    one row of float64 features per formula.
+
+    The database is in WAL mode, so that many processes can read it while one writes.
+    When it grows over max_size, the least recently used features are deleted
+    (last used to within a minute, so that reading seldom needs the write lock).
+
+    Parameters
+    ----------
+    path : str or Path, optional
+        database file, default is 'features.sqlite' in the user cache directory.
+    max_size : int
+        max size (bytes) of the database.
+
+    '''
+
+    _batch_size = 500  # keys in a query.
+    _touch_interval = 60  # min time (s) between two updates of the last_used of a row.
+
+    def __init__(self, path=None, max_size=2 ** 30):
+
+        self.path = get_cache_dir() / 'features.sqlite' if path is None else Path(path)
+        self.max_size = max_size
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS features ('
+                'key TEXT NOT NULL, version TEXT NOT NULL, value BLOB NOT NULL, last_used REAL NOT NULL, '
+                'PRIMARY KEY (key, version))'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS features_last_used ON features (last_used)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    @staticmethod
+    def get_version(df_elemental_attributes, feature_names):
+        '''
+        Version of the features, a hash of the attribute table and the feature names.
+
+        Parameters
+        ----------
+        df_elemental_attributes : DataFrame
+            elemental attributes, attributes as index, elements as columns.
+        feature_names : list
+            names of the features.
+
+        Returns
+        -------
+        version : str
+
+        '''
+
+        sha = hashlib.sha256()
+        sha.update(json.dumps([list(df_elemental_attributes.index), list(df_elemental_attributes.columns)]).encode())
+        sha.update(np.ascontiguousarray(df_elemental_attributes.to_numpy(dtype='float64')).tobytes())
+        sha.update(json.dumps(list(feature_names)).encode())
+        return sha.hexdigest()[:16]
+
+    def get(self, keys, version, out):
+        '''
+        Getting the stored features.
+
+        Parameters
+        ----------
+        keys : list
+            canonical chemical formulas.
+        version : str
+            version of the features.
+        out : ndarray
+            (keys x features) array, the rows of the stored features are filled.
+
+        Returns
+        -------
+        is_stored : ndarray
+            (keys, ) bool, whether the features of each key were stored.
+
+        '''
+
+        positions = {}
+        for i, key in enumerate(keys):
+            positions.setdefault(key, []).append(i)
+
+        is_stored = np.zeros(len(keys), dtype=bool)
+        unique_keys = list(positions)
+        now = time.time()
+        used_keys = []
+        with closing(self._connect()) as connection:
+            # reading without a write lock, the SELECTs do not open a transaction.
+            for start in range(0, len(unique_keys), self._batch_size):
+                batch = unique_keys[start:start + self._batch_size]
+                placeholders = ','.join('?' * len(batch))
+                rows = connection.execute(
+                    'SELECT key, value, last_used FROM features WHERE version = ? AND key IN (%s)' % placeholders,
+                    [version] + batch
+                ).fetchall()
+                for key, value, last_used in rows:
+                    rows_of_key = positions[key]
+                    out[rows_of_key] = np.frombuffer(value, dtype='float64')
+                    is_stored[rows_of_key] = True
+                    if now - last_used > self._touch_interval:
+                        used_keys.append(key)
+
+            # then refreshing last_used in one short transaction,
+            # only where it is older than _touch_interval (the LRU order is approximate).
+            if used_keys:
+                with connection:
+                    for start in range(0, len(used_keys), self._batch_size):
+                        batch = used_keys[start:start + self._batch_size]
+                        connection.execute(
+                            'UPDATE features SET last_used = ? WHERE version = ? AND key IN (%s)'
+                            % ','.join('?' * len(batch)),
+                            [now, version] + batch
+                        )
+
+        return is_stored
+
+    def put(self, keys, version, values):
+        '''
+        Storing features, then deleting the least recently used ones if the database is over max_size.
+
+        Parameters
+        ----------
+        keys : list
+            canonical chemical formulas.
+        version : str
+            version of the features.
+        values : ndarray
+            (keys x features).
+
+        '''
+
+        now = time.time()
+        values = np.asarray(values, dtype='float64')
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO features (key, version, value, last_used) VALUES (?, ?, ?, ?)',
+                ((key, version, value.tobytes(), now) for key, value in zip(keys, values))
+            )
+            self._evict(connection)
+
+    def _evict(self, connection):
+        page_size, = connection.execute('PRAGMA page_size').fetchone()
+        page_count, = connection.execute('PRAGMA page_count').fetchone()
+        freelist_count, = connection.execute('PRAGMA freelist_count').fetchone()
+        size = (page_count - freelist_count) * page_size
+        if size <= self.max_size:
+            return
+
+        # deleting down to 90% of max_size, assuming the rows are of about the same size.
+        n_rows, = connection.execute('SELECT COUNT(*) FROM features').fetchone()
+        n_deleted = int(np.ceil(n_rows * (1 - 0.9 * self.max_size / size)))
+        connection.execute(
+            'DELETE FROM features WHERE rowid IN (SELECT rowid FROM features ORDER BY last_used LIMIT ?)',
+            (n_deleted, )
+        )
+
+    def clear(self):
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM features')
+
+    def __len__(self):
+        with closing(self._connect()) as connection:
+            n_rows, = connection.execute('SELECT COUNT(*) FROM features').fetchone()
+        return n_rows
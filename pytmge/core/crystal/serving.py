@@ -0,0 +1,170 @@
+# coding: utf-8
+# Copyright (c) pytmge Development Team.
+
+"""
+Serving the features of chemical formulas to asyncio applications.
+
+"""
+
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from pytmge.core.crystal.chemical_formulas import parse_formula
+from pytmge.core.crystal.feature import Featurizer
+from pytmge.core.plugins import get_n_jobs
+
+
+__author__ = 'Yang LIU'
+__maintainer__ = 'Yang LIU'
+__email__ = 'l_young@live.cn'
+__version__ = '1.0'
+__date__ = '2022/3/18'
+
+
+_worker_featurizer = {}
+
+
+def _init_worker(featurizer):
+    # the featurizer is sent once to each worker process.
+    _worker_featurizer['featurizer'] = featurizer
+
+
+def _featurize_many(formulas):
+    return _worker_featurizer['featurizer'].featurize_many(formulas)
+
+
+class AsyncFeaturizer:
+    '''
+    Featurizing single chemical formulas from coroutines, in micro-batches.
+
+    The requests are collected until max_batch_size of them are waiting or max_delay has passed,
+    then featurized at once by Featurizer.featurize_many() in a thread or process pool,
+    so that the event loop is never blocked.
+
+    Parameters
+    ----------
+    featurizer : Featurizer, optional
+        default is Featurizer() of all the features.
+    max_batch_size : int
+        max number of chemical formulas in a batch.
+    max_delay : float
+        max time (s) a request waits for its batch to fill.
+    n_jobs : int
+        number of threads or processes running the batches, -1 means all CPUs.
+    use_processes : bool
+        whether to run the batches in processes instead of threads.
+
+    Examples
+    --------
+    >>> async with AsyncFeaturizer(max_batch_size=256, max_delay=0.002) as featurizer:
+    ...     features = await featurizer.featurize('H2O1')
+
+    '''
+
+    def __init__(self, featurizer=None, max_batch_size=256, max_delay=0.002, n_jobs=1, use_processes=False):
+
+        self.featurizer = Featurizer() if featurizer is None else featurizer
+        self.feature_names = self.featurizer.feature_names
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+
+        n_jobs = get_n_jobs(n_jobs)
+        if use_processes:
+            self._executor = ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=(self.featurizer,))
+            self._featurize_many = _featurize_many
+        else:
+            self._executor = ThreadPoolExecutor(n_jobs)
+            self._featurize_many = self.featurizer.featurize_many
+
+        self._pending = []  # (formula, future) waiting for their batch.
+        self._timer = None
+        self._tasks = set()  # batches being featurized.
+
+    async def featurize(self, formula):
+        '''
+        Parameters
+        ----------
+        formula : str
+            chemical formula, like 'H2O1'.
+
+        Returns
+        -------
+        features : ndarray
+            (features, ), named by feature_names.
+
+        '''
+
+        if parse_formula(formula) is None:
+            raise ValueError('chemical formula seems not right : ' + repr(formula))
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((formula, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+
+        return await future
+
+    def _flush(self):
+        # sending the pending requests to the pool, in batches of max_batch_size.
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batches = [self._pending[i:i + self.max_batch_size] for i in range(0, len(self._pending), self.max_batch_size)]
+        self._pending = []
+        for batch in batches:
+            task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            task.add_done_callback(functools.partial(self._cancel_requests, batch))
+
+    @staticmethod
+    def _cancel_requests(batch, task):
+        # the requests left when the task is done, e.g. cancelled (even before it started),
+        # are cancelled too, instead of waiting forever.
+        for _, future in batch:
+            if not future.done():
+                future.cancel()
+
+    async def _run_batch(self, batch):
+        batch = [(formula, future) for formula, future in batch if not future.cancelled()]
+        if not batch:
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            features = await loop.run_in_executor(
+                self._executor, self._featurize_many, [formula for formula, _ in batch]
+            )
+            for (_, future), f in zip(batch, features):
+                if not future.done():
+                    # a copy, so that a result kept by the caller does not keep the whole batch.
+                    future.set_result(f.copy())
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def close(self):
+        '''
+        Featurizing the pending requests, then shutting down the pool.
+
+        '''
+
+        if self._pending:
+            self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -1,8 +1,8 @@
-# coding: utf-8
-# Copyright (c) pytmge Development Team.
-
-"""
-This package contains modules and classes
-for machine learning to predict molecules.
-
-"""
+# coding: utf-8
+# Copyright (c) pytmge Development Team.
+
+"""
+This package contains modules and classes
+for machine learning to predict molecules.
+
+"""
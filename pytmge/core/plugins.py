@@ -1,19 +1,141 @@
-# coding: utf-8
-# Copyright (c) pytmge Development Team.
-
-"""
-
-"""
-
-import sys
-import math
-
-
-def progressbar(current, total):
-    if True:
-        percent = '{:.2%}'.format(current / total)
-        sys.stdout.write('\r[%-50s] %s' % ('=' * math.floor(current * 50 / total), percent))
-        sys.stdout.flush()
-        if current == total:
-            print()
-    return
+# coding: utf-8
+# Copyright (c) pytmge Development Team.
+
+"""
+
+"""
+
+import os
+import sys
+import math
+import time
+import logging
+import uuid
+from pathlib import Path
+
+
+def progressbar(current, total):
+    if True:
+        percent = '{:.2%}'.format(current / total)
+        sys.stdout.write('\r[%-50s] %s' % ('=' * math.floor(current * 50 / total), percent))
+        sys.stdout.flush()
+        if current == total:
+            print()
+    return
+
+
+def _print_progress(event):
+    # the default hook, the progressbar on stdout, then the timing of the stage.
+    progressbar(event['current'], event['total'])
+    if event['current'] >= event['total']:
+        print('  %s: %d in %.3f s (%.0f /s)' % (event['stage'], event['total'], event['elapsed'], event['rate']))
+
+
+_progress_settings = {
+    'enabled': os.environ.get('PYTMGE_PROGRESS', '1') != '0',
+    'interval': 0.2,
+    'hook': _print_progress,
+}
+
+
+def set_progress(enabled=True, interval=0.2, hook=None):
+    '''
+    Setting how the progress of the stages (parsing, features, distances, ...) is reported.
+    It can also be disabled by the environment variable PYTMGE_PROGRESS=0.
+
+    Parameters
+    ----------
+    enabled : bool
+        whether to report the progress.
+    interval : float
+        min time (s) between two reports of a stage, the end of a stage is always reported.
+    hook : callable or logging.Logger, optional
+        hook(event) is called with event = {'stage', 'current', 'total', 'elapsed', 'rate'},
+        elapsed in seconds, rate in items per second.
+        A logger logs the events at INFO level.
+        Default is the progressbar on stdout.
+
+    '''
+
+    if isinstance(hook, logging.Logger):
+        logger = hook
+
+        def hook(event):
+            logger.info(
+                '%s: %d/%d in %.3f s (%.0f /s)',
+                event['stage'], event['current'], event['total'], event['elapsed'], event['rate']
+            )
+
+    _progress_settings['enabled'] = enabled
+    _progress_settings['interval'] = interval
+    _progress_settings['hook'] = _print_progress if hook is None else hook
+
+
+class Progress:
+    '''
+    Progress of a stage, reported at most once per interval (see set_progress).
+
+    Parameters
+    ----------
+    total : int
+        number of items of the stage.
+    stage : str
+        name of the stage.
+
+    '''
+
+    def __init__(self, total, stage=''):
+        self.total = total
+        self.stage = stage
+        self._start = time.perf_counter()
+        self._last_report = -math.inf
+
+    def update(self, current):
+        if not _progress_settings['enabled']:
+            return
+        now = time.perf_counter()
+        if current < self.total and now - self._last_report < _progress_settings['interval']:
+            return
+        self._last_report = now
+        elapsed = now - self._start
+        _progress_settings['hook']({
+            'stage': self.stage,
+            'current': current,
+            'total': self.total,
+            'elapsed': elapsed,
+            'rate': current / elapsed if elapsed > 0 else math.inf,
+        })
+
+
+def get_n_jobs(n_jobs):
+    # n_jobs = -1 means all CPUs, -2 all but one, and so on.
+    if n_jobs < 0:
+        n_jobs = (os.cpu_count() or 1) + 1 + n_jobs
+    return max(int(n_jobs), 1)
+
+
+def get_cache_dir():
+    # PYTMGE_CACHE_DIR, or 'pytmge' in the user cache directory.
+    path = os.environ.get('PYTMGE_CACHE_DIR')
+    if not path:
+        root = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA')
+        path = os.path.join(root or os.path.join(os.path.expanduser('~'), '.cache'), 'pytmge')
+    return Path(path)
+
+
+def atomic_write(path, write):
+    # write(f) writes to a temporary binary file in the same directory, which is then renamed to path,
+    # so that concurrent readers see either the old file or the complete new one.
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # created as by open(), 0666 minus the umask (mkstemp would make it readable by its owner only).
+    tmp_path = path.parent / '{}.{}.tmp'.format(path.name, uuid.uuid4().hex)
+    fd = os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as _f:
+            write(_f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -1,287 +1,514 @@
-# coding: utf-8
-# Copyright (c) pytmge Development Team.
-
-"""
-Providing data of fundamental attributes of elements.
-
-"""
-
-
-import numpy as np
-import pandas as pd
-from pathlib import Path
-import json
-import warnings
-
-
-__author__ = 'Yang LIU'
-__maintainer__ = 'Yang LIU'
-__email__ = 'l_young@live.cn'
-__version__ = '1.0'
-__date__ = '2022/3/18'
-
-
-_data_path = str(Path(__file__).absolute().parent) + '\\'
-
-
-class elemental_data():
-
-    def __init__(self):
-
-        self.orbital_attributes_of_shells = self._orbital_attributes_of_shells()
-        self.orbital_attributes_of_elements = self._orbital_attributes_of_elements()
-        self.atomic_attributes_of_elements = self._atomic_attributes_of_elements()
-        self.occupancy_of_electron_shells = self._occupancy_of_electron_shells()
-        self.energy_level_of_electron_shells = self._energy_level_of_electron_shells()
-        self.symbols = list(self.occupancy_of_electron_shells)
-
-    def _orbital_attributes_of_shells(self):
-        with open(_data_path + "orbital_attributes_of_shells.json", "rt") as _f:
-            _data = json.load(_f)
-        return _data
-
-    def _orbital_attributes_of_elements(self):
-        with open(_data_path + "orbital_attributes_of_elements.json", "rt") as _f:
-            _data = json.load(_f)
-        df_orbital_attributes_of_elements = pd.DataFrame.from_dict(_data, orient='index')
-        return df_orbital_attributes_of_elements
-
-    def _atomic_attributes_of_elements(self):
-        with open(_data_path + "atomic_attributes_of_elements.json", "rt") as _f:
-            _data = json.load(_f)
-        return _data
-
-    def _occupancy_of_electron_shells(self):
-        # Herman, F., Sherwood Skillman, S. and Arents, J. Atomic Structure Calculations. Vol. 111 (Prentice-Hall, 1964).
-        with open(_data_path + "occupancy_of_electron_shells.json", "rt") as _f:
-            _data = json.load(_f)
-        return _data
-
-    def _energy_level_of_electron_shells(self):
-        # Herman, F., Sherwood Skillman, S. and Arents, J. Atomic Structure Calculations. Vol. 111 (Prentice-Hall, 1964).
-        with open(_data_path + "energy_level_of_electron_shells.json", "rt") as _f:
-            _data = json.load(_f)
-        return _data
-
-
-class electron_orbital_attribute:
-    '''
-    Extracting electron orbital attributes of each element.
-    A elemental_attributes = [attribute].[_shell_selection].[math operator]
-
-    '''
-
-    def __init__(self):
-
-        self._data_source = '[Herman, F., Sherwood Skillman, S. and Arents, J. Atomic Structure Calculations. Vol. 111 (Prentice-Hall, 1964).]'
-        self._shell_occupancy = pd.DataFrame.from_dict(elemental_data().occupancy_of_electron_shells, orient='index')
-        self._shell_energy = pd.DataFrame.from_dict(elemental_data().energy_level_of_electron_shells, orient='index')
-        self._elements = list(self._shell_occupancy.index)
-        self._shells = list(self._shell_occupancy.columns)
-
-        self._valence = self._get_valence()  # energy_threshold = -36 eV
-        self._valence_energy = self._shell_energy * self._valence  # energy level
-        self._valence_number_of_allowed = self._get_valence_number_of_allowed()
-        self._valence_number_of_filled = self._shell_occupancy * self._valence  # filled number
-        self._valence_number_of_unfilled = self._valence_number_of_allowed - self._valence_number_of_filled  # unfilled number of _valence shells
-        self._valence_filling_rate = self._valence_number_of_filled / self._valence_number_of_allowed
-        self._valence_filling_saturation = self._get_valence_filling_saturation()  # is fully filled ?
-        self._valence_filling_parity = self._valence_number_of_filled % 2  # filling parity (odd or even)
-        self._valence_main_quantum_number = self._get_valence_main_quantum_number()
-        self._valence_angular_quantum_number = self._get_valence_angular_quantum_number()
-
-        self._attributes = self._get_attributes()
-        self._shell_selection = self._get_shell_selection()
-
-        self.shell_attributes = self._get_shell_attributes()
-        self.elemental_attributes = self._get_elemental_attributes()
-
-    def _get_valence(self):
-        energy_threshold = -36  # the shells in [0, -36] (eV) are considered as valence shells.
-        return (self._shell_energy.applymap(lambda x: x >= energy_threshold) * 1).replace(0, np.nan)
-
-    def _get_valence_number_of_allowed(self):
-        list_a = [2, 2, 6, 2, 6, 10, 2, 6, 10, 14, 2, 6, 10, 14, 2, 6, 10, 2]  # 18 shells in total
-        df_a = pd.DataFrame(pd.Series(list_a, index=self._shells)).T
-        df_1 = pd.DataFrame(index=self._elements, columns=['shells']).fillna(1)
-        allowed = pd.DataFrame(np.dot(df_1, df_a), index=self._elements, columns=self._shells)
-        return self._valence * allowed
-
-    def _get_valence_filling_saturation(self):
-        return self._valence_filling_rate.fillna(0).applymap(lambda x: int(x)) * self._valence
-
-    def _get_valence_main_quantum_number(self):
-        _main_quantum_number = self._valence.apply(
-            lambda x:
-                pd.Series(
-                    [int(self._shells[i][0])
-                     if x[i] == 1
-                     else np.nan
-                     for i in list(range(18))],
-                    index=self._shells
-                ),
-            axis=1
-        )
-        return _main_quantum_number
-
-    def _get_valence_angular_quantum_number(self):
-        _angular_quantum_number = self._valence.apply(
-            lambda x:
-                pd.Series(
-                    [['s', 'p', 'd', 'f'].index(self._shells[i][1])
-                     if x[i] == 1
-                     else np.nan
-                     for i in list(range(18))],
-                    index=self._shells
-                ),
-            axis=1
-        )
-        return _angular_quantum_number
-
-    def _get_attributes(self):
-        '''
-        Getting attributes of all _valence orbitals.
-
-        Returns
-        -------
-        attributes : dict
-            Each of its values is a Pandas DataFrame (index=elemnts, columns=shells),
-
-        '''
-
-        attributes = {}
-        attributes['E'] = self._valence_energy
-        attributes['Nf'] = self._valence_number_of_filled
-        attributes['Nu'] = self._valence_number_of_unfilled
-
-        attributes['Fr'] = self._valence_filling_rate
-        attributes['Fs'] = self._valence_filling_saturation
-        attributes['Fp'] = self._valence_filling_parity
-
-        attributes['n'] = self._valence_main_quantum_number
-        attributes['l'] = self._valence_angular_quantum_number
-
-        return attributes
-
-    def _get_shell_selection(self):
-        '''
-        Assigning which shells are considered.
-
-        Returns
-        -------
-        _shell_selection : dict
-            Each of its values is a Pandas DataFrame (index=elemnts, columns=shells),
-            in which the selected shells are 1, else are 0.
-
-        '''
-
-        _shell_selection = {}
-
-        aqn = self._valence_angular_quantum_number
-        nu = self._valence_number_of_unfilled
-
-        # all _valence
-        _shell_selection['all'] = self._valence * 1
-
-        # single shell
-        _shell_selection['s'] = aqn.applymap(lambda x: 1 if x == 0 else np.nan)
-        _shell_selection['p'] = aqn.applymap(lambda x: 1 if x == 1 else np.nan)
-        _shell_selection['d'] = aqn.applymap(lambda x: 1 if x == 2 else np.nan)
-        _shell_selection['f'] = aqn.applymap(lambda x: 1 if x == 3 else np.nan)
-
-        # sat: fully occupied
-        # unsat: not fully occupied
-        _shell_selection['sat'] = (nu.applymap(lambda x: x == 0) * 1).replace(0, np.nan)
-        _shell_selection['unsat'] = (nu.applymap(lambda x: x > 0) * 1).replace(0, np.nan)
-
-        # outer: outer shells in real space (s and p shells)
-        # inner: inner shells in real space (d and f shells)
-        _shell_selection['outer'] = aqn.applymap(lambda x: 1 if x <= 1 else np.nan)
-        _shell_selection['inner'] = aqn.applymap(lambda x: 1 if x >= 2 else np.nan)
-
-        return _shell_selection
-
-    def _get_shell_attributes(self):
-        '''
-        Getting shell attributes.
-
-        A shell_attribute = [attribute].[_shell_selection]
-
-        Parameters
-        ----------
-        attributes : dict
-            Attributes of all _valence orbitals.
-        _shell_selection : dict
-            Which shells are considered.
-
-        Returns
-        -------
-        shell_attributes : dict
-            Attributes of selected shells.
-
-        '''
-
-        shell_attributes = {}
-        for oa, df_orbital_attributes in self._attributes.items():
-            for ss, df__shell_selection in self._shell_selection.items():
-                shell_attributes[oa + '.' + ss] = df_orbital_attributes * df__shell_selection
-
-        dict_shell_attributesa = {}
-        for _name, _attr in shell_attributes.items():
-            dict_shell_attributesa[_name] = _attr.to_dict(orient='index')
-        with open(_data_path + 'orbital_attributes_of_shells.json', 'w') as _f:
-            json.dump(dict_shell_attributesa, _f)
-
-        return shell_attributes
-
-    def _get_elemental_attributes(self):
-        '''
-        Getting elemental attributes.
-
-        A elemental_attribute = [attribute].[_shell_selection].[math operator]
-
-        Returns
-        -------
-        elemental_attributes : dict
-            Elemental attributes.
-
-        '''
-
-        warnings.filterwarnings('ignore')
-
-        elemental_attributes = {}
-        for name_of_shell_attribute, shell_attribute in self.shell_attributes.items():
-
-            atomic_avg = np.nanmean(shell_attribute, axis=1)  # atomic_avg = nan when all_shells_are_empty.
-            atomic_std = np.nanstd(shell_attribute, axis=1)
-            atomic_max = np.nanmax(shell_attribute, axis=1)
-            atomic_min = np.nanmin(shell_attribute, axis=1)
-            atomic_range = atomic_max - atomic_min
-
-            is_nan = atomic_avg - atomic_avg  # if all_shells_are_empty is_nan = nan, else is_nan = 0.
-            atomic_sum = np.nansum(shell_attribute, axis=1) + is_nan  # when the whole row is empty, the atomic_sum is nan.
-            weights = self._valence_number_of_filled * self._shell_selection[name_of_shell_attribute.split('.')[1]]
-            atomic_wavg = np.nansum(shell_attribute * weights, axis=1) / weights.sum(axis=1) + is_nan  # when the whole row is empty, the atomic_wavg is nan.
-
-            ds_atomic_avg = pd.Series(np.round(atomic_avg, 6), index=self._elements, dtype='float64')
-            ds_atomic_std = pd.Series(np.round(atomic_std, 6), index=self._elements, dtype='float64')
-            ds_atomic_max = pd.Series(np.round(atomic_max, 6), index=self._elements, dtype='float64')
-            ds_atomic_min = pd.Series(np.round(atomic_min, 6), index=self._elements, dtype='float64')
-            ds_atomic_range = pd.Series(np.round(atomic_range, 6), index=self._elements, dtype='float64')
-            ds_atomic_sum = pd.Series(np.round(atomic_sum, 6), index=self._elements, dtype='float64')
-            ds_atomic_wavg = pd.Series(np.round(atomic_wavg, 6), index=self._elements, dtype='float64')
-
-            elemental_attributes[name_of_shell_attribute + '.avg'] = ds_atomic_avg.to_dict()
-            elemental_attributes[name_of_shell_attribute + '.std'] = ds_atomic_std.to_dict()
-            elemental_attributes[name_of_shell_attribute + '.max'] = ds_atomic_max.to_dict()
-            elemental_attributes[name_of_shell_attribute + '.min'] = ds_atomic_min.to_dict()
-            elemental_attributes[name_of_shell_attribute + '.range'] = ds_atomic_range.to_dict()
-            elemental_attributes[name_of_shell_attribute + '.sum'] = ds_atomic_sum.to_dict()
-            elemental_attributes[name_of_shell_attribute + '.wavg'] = ds_atomic_wavg.to_dict()
-
-        with open(_data_path + 'elemental_attributes.json', 'w') as _f:
-            json.dump(elemental_attributes, _f)
-
-        warnings.resetwarnings
-
-        return elemental_attributes
+# coding: utf-8
+# Copyright (c) pytmge Development Team.
+
+"""
+Providing data of fundamental attributes of elements.
+
+"""
+
+
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from functools import cached_property, lru_cache
+import hashlib
+import json
+import warnings
+
+from pytmge.core.plugins import get_cache_dir, atomic_write
+
+
+__author__ = 'Yang LIU'
+__maintainer__ = 'Yang LIU'
+__email__ = 'l_young@live.cn'
+__version__ = '1.0'
+__date__ = '2022/3/18'
+
+
+_data_path = str(Path(__file__).absolute().parent) + os.sep
+
+# the elemental data are loaded from a binary bundle of arrays,
+# built from the source json files, and rebuilt when they change (see load_bundle).
+_bundle_version = 1
+_source_files = [
+    'atomic_attributes_of_elements.json',
+    'occupancy_of_electron_shells.json',
+    'energy_level_of_electron_shells.json',
+    'orbital_attributes_of_elements.json',
+    'orbital_attributes_of_shells.json',
+]
+_bundle = {}
+
+
+def _read_json(file_name):
+    with open(_data_path + file_name, "rt") as _f:
+        _data = json.load(_f)
+    return _data
+
+
+def _source_checksum():
+    sha = hashlib.sha256(str(_bundle_version).encode())
+    for file_name in _source_files:
+        with open(_data_path + file_name, "rb") as _f:
+            sha.update(_f.read())
+    return sha.hexdigest()[:16]
+
+
+def _build_bundle():
+    '''
+    Converting the source json files to arrays.
+
+    Returns
+    -------
+    bundle : dict
+        name: ndarray, empty values (None) are nan.
+
+    '''
+
+    occupancy = _read_json('occupancy_of_electron_shells.json')
+    energy = _read_json('energy_level_of_electron_shells.json')
+    attributes_of_elements = _read_json('orbital_attributes_of_elements.json')
+    attributes_of_shells = _read_json('orbital_attributes_of_shells.json')
+
+    symbols = list(occupancy)
+    shells = list(occupancy[symbols[0]])
+
+    bundle = {
+        'symbols': np.array(symbols),
+        'shells': np.array(shells),
+        'occupancy': np.array([[occupancy[e][s] for s in shells] for e in symbols], dtype='float64'),
+        'energy': np.array([[energy[e][s] for s in shells] for e in symbols], dtype='float64'),
+        'attribute_names': np.array(list(attributes_of_elements)),
+        'attribute_elements': np.array(list(next(iter(attributes_of_elements.values())))),
+        'attributes_of_elements': np.array([list(a.values()) for a in attributes_of_elements.values()], dtype='float64'),
+        'shell_attribute_names': np.array(list(attributes_of_shells)),
+        'attributes_of_shells': np.array(
+            [[[a[e][s] for s in shells] for e in symbols] for a in attributes_of_shells.values()], dtype='float64'
+        ),
+        'atomic_attributes_of_elements': np.array(json.dumps(_read_json('atomic_attributes_of_elements.json'))),
+    }
+
+    return bundle
+
+
+def load_bundle():
+    '''
+    Loading the elemental data as arrays, once per process.
+
+    The arrays are read from 'elemental_data.v[version].[checksum].npz' in the cache directory,
+    where the checksum is that of the source json files,
+    and the bundle is (re)built from the json files when it is missing.
+
+    Returns
+    -------
+    bundle : dict
+        name: ndarray.
+
+    '''
+
+    if not _bundle:
+        path = get_cache_dir() / ('elemental_data.v%d.%s.npz' % (_bundle_version, _source_checksum()))
+        try:
+            with np.load(path) as _f:
+                bundle = {name: _f[name] for name in _f.files}
+        except (OSError, ValueError):
+            bundle = _build_bundle()
+            try:
+                atomic_write(path, lambda _f: np.savez(_f, **bundle))
+            except OSError:
+                pass  # the cache directory is not writable, rebuild next time.
+        _bundle.update(bundle)
+
+    return _bundle
+
+
+class elemental_data():
+    '''
+    Elemental data.
+    Each of them is loaded on first access, from the bundle of arrays (see load_bundle).
+
+    '''
+
+    @cached_property
+    def orbital_attributes_of_shells(self):
+        return self._orbital_attributes_of_shells()
+
+    @cached_property
+    def orbital_attributes_of_elements(self):
+        return self._orbital_attributes_of_elements()
+
+    @cached_property
+    def atomic_attributes_of_elements(self):
+        return self._atomic_attributes_of_elements()
+
+    @cached_property
+    def occupancy_of_electron_shells(self):
+        return self._occupancy_of_electron_shells()
+
+    @cached_property
+    def energy_level_of_electron_shells(self):
+        return self._energy_level_of_electron_shells()
+
+    @cached_property
+    def symbols(self):
+        return load_bundle()['symbols'].tolist()
+
+    def _orbital_attributes_of_shells(self):
+        bundle = load_bundle()
+        symbols = bundle['symbols'].tolist()
+        shells = bundle['shells'].tolist()
+        _data = {}
+        for name, values in zip(bundle['shell_attribute_names'].tolist(), bundle['attributes_of_shells'].tolist()):
+            _data[name] = {e: dict(zip(shells, v)) for e, v in zip(symbols, values)}
+        return _data
+
+    def _orbital_attributes_of_elements(self):
+        bundle = load_bundle()
+        df_orbital_attributes_of_elements = pd.DataFrame(
+            bundle['attributes_of_elements'],
+            index=bundle['attribute_names'].tolist(),
+            columns=bundle['attribute_elements'].tolist()
+        )
+        return df_orbital_attributes_of_elements
+
+    def _atomic_attributes_of_elements(self):
+        _data = json.loads(str(load_bundle()['atomic_attributes_of_elements']))
+        return _data
+
+    def _occupancy_of_electron_shells(self):
+        # Herman, F., Sherwood Skillman, S. and Arents, J. Atomic Structure Calculations. Vol. 111 (Prentice-Hall, 1964).
+        return self._shell_table('occupancy')
+
+    def _energy_level_of_electron_shells(self):
+        # Herman, F., Sherwood Skillman, S. and Arents, J. Atomic Structure Calculations. Vol. 111 (Prentice-Hall, 1964).
+        return self._shell_table('energy')
+
+    def _shell_table(self, name):
+        # {element: {shell: value}}, empty values are None, as in the json file.
+        bundle = load_bundle()
+        shells = bundle['shells'].tolist()
+        _data = {}
+        for e, values in zip(bundle['symbols'].tolist(), bundle[name].tolist()):
+            _data[e] = {s: (None if np.isnan(v) else v) for s, v in zip(shells, values)}
+        return _data
+
+
+class electron_orbital_attribute:
+    '''
+    Extracting electron orbital attributes of each element.
+    A elemental_attributes = [attribute].[_shell_selection].[math operator]
+
+    Parameters
+    ----------
+    energy_threshold : float
+        the shells in [0, energy_threshold] (eV) are considered as valence shells.
+
+    '''
+
+    _version = 1  # of the derived tables, for the cache key.
+
+    _attribute_names = ['E', 'Nf', 'Nu', 'Fr', 'Fs', 'Fp', 'n', 'l']
+    _selection_names = ['all', 's', 'p', 'd', 'f', 'sat', 'unsat', 'outer', 'inner']
+    _operator_names = ['avg', 'std', 'max', 'min', 'range', 'sum', 'wavg']
+
+    def __init__(self, energy_threshold=-36):
+
+        self._data_source = '[Herman, F., Sherwood Skillman, S. and Arents, J. Atomic Structure Calculations. Vol. 111 (Prentice-Hall, 1964).]'
+        bundle = load_bundle()
+        self._elements = bundle['symbols'].tolist()
+        self._shells = bundle['shells'].tolist()
+        self._shell_occupancy = bundle['occupancy']  # (elements x shells), empty shells are nan.
+        self._shell_energy = bundle['energy']
+        self._energy_threshold = energy_threshold
+
+        self._valence = self._get_valence()
+        self._valence_number_of_filled = self._shell_occupancy * self._valence  # filled number
+
+        self._attributes = self._get_attributes()  # (elements x shells x attributes)
+        self._shell_selection = self._get_shell_selection()  # (elements x shells x selections)
+
+        # shell_attributes and elemental_attributes are computed on first access,
+        # or loaded from the cache directory (see save() and load()).
+
+    @cached_property
+    def shell_attributes(self):
+        return self._get_shell_attributes()
+
+    @cached_property
+    def elemental_attributes(self):
+        return self._get_elemental_attributes()
+
+    def _get_cache_key(self):
+        # the derived tables only depend on the energy_threshold, the occupancy and energy levels of the shells.
+        sha = hashlib.sha256(('electron_orbital_attribute.v%d' % self._version).encode())
+        sha.update(repr(float(self._energy_threshold)).encode())
+        sha.update(json.dumps([self._elements, self._shells]).encode())
+        sha.update(self._shell_occupancy.tobytes())
+        sha.update(self._shell_energy.tobytes())
+        return sha.hexdigest()[:16]
+
+    def get_cache_path(self, cache_dir=None):
+        '''
+        Path of the saved shell_attributes and elemental_attributes,
+        named after the content of the data they are derived from.
+
+        Parameters
+        ----------
+        cache_dir : str or Path
+            default is the user cache directory (plugins.get_cache_dir).
+
+        '''
+
+        cache_dir = get_cache_dir() if cache_dir is None else Path(cache_dir)
+        return cache_dir / ('electron_orbital_attribute.%s.npz' % self._get_cache_key())
+
+    def save(self, cache_dir=None):
+        '''
+        Saving shell_attributes and elemental_attributes to the cache directory.
+        The file is written atomically, so that many processes can share it.
+
+        Returns
+        -------
+        path : Path
+            the saved file.
+
+        '''
+
+        path = self.get_cache_path(cache_dir)
+        if not path.exists():
+            arrays = {
+                'shell_attribute_names': np.array(list(self.shell_attributes)),
+                'shell_attributes': np.array(
+                    [a.to_numpy(dtype='float64') for a in self.shell_attributes.values()]
+                ),
+                'elemental_attribute_names': np.array(list(self.elemental_attributes)),
+                'elemental_attributes': np.array(
+                    [[a[e] for e in self._elements] for a in self.elemental_attributes.values()], dtype='float64'
+                ),
+            }
+            atomic_write(path, lambda _f: np.savez(_f, **arrays))
+        return path
+
+    def load(self, cache_dir=None):
+        '''
+        Loading shell_attributes and elemental_attributes from the cache directory,
+        if they have been saved before.
+
+        Returns
+        -------
+        is_loaded : bool
+            False if there is no saved file, then they are computed on first access.
+
+        '''
+
+        try:
+            with np.load(self.get_cache_path(cache_dir)) as _f:
+                arrays = {name: _f[name] for name in _f.files}
+        except (OSError, ValueError):
+            return False
+
+        self.__dict__['shell_attributes'] = {
+            name: pd.DataFrame(a, index=self._elements, columns=self._shells)
+            for name, a in zip(arrays['shell_attribute_names'].tolist(), arrays['shell_attributes'])
+        }
+        self.__dict__['elemental_attributes'] = {
+            name: dict(zip(self._elements, a))
+            for name, a in zip(arrays['elemental_attribute_names'].tolist(), arrays['elemental_attributes'].tolist())
+        }
+
+        return True
+
+    def _get_valence(self):
+        # the shells in [0, energy_threshold] (eV) are considered as valence shells.
+        with np.errstate(invalid='ignore'):
+            return np.where(self._shell_energy >= self._energy_threshold, 1.0, np.nan)
+
+    def _get_attributes(self):
+        '''
+        Getting attributes of all _valence orbitals.
+
+        Returns
+        -------
+        attributes : ndarray
+            (elements x shells x attributes), in the order of _attribute_names,
+            nan for the shells out of _valence.
+
+        '''
+
+        number_of_allowed = np.array([2, 2, 6, 2, 6, 10, 2, 6, 10, 14, 2, 6, 10, 14, 2, 6, 10, 2])  # 18 shells in total
+        main_quantum_number = np.array([int(shell[0]) for shell in self._shells])
+        angular_quantum_number = np.array([['s', 'p', 'd', 'f'].index(shell[1]) for shell in self._shells])
+
+        valence_energy = self._shell_energy * self._valence  # energy level
+        valence_number_of_allowed = number_of_allowed * self._valence
+        valence_number_of_filled = self._valence_number_of_filled
+        valence_number_of_unfilled = valence_number_of_allowed - valence_number_of_filled  # unfilled number of _valence shells
+        valence_filling_rate = valence_number_of_filled / valence_number_of_allowed
+        valence_filling_saturation = np.trunc(np.nan_to_num(valence_filling_rate)) * self._valence  # is fully filled ?
+        valence_filling_parity = valence_number_of_filled % 2  # filling parity (odd or even)
+
+        attributes = np.stack([
+            valence_energy,  # E
+            valence_number_of_filled,  # Nf
+            valence_number_of_unfilled,  # Nu
+            valence_filling_rate,  # Fr
+            valence_filling_saturation,  # Fs
+            valence_filling_parity,  # Fp
+            main_quantum_number * self._valence,  # n
+            angular_quantum_number * self._valence,  # l
+        ], axis=-1)
+
+        return attributes
+
+    def _get_shell_selection(self):
+        '''
+        Assigning which shells are considered.
+
+        Returns
+        -------
+        _shell_selection : ndarray
+            (elements x shells x selections), in the order of _selection_names,
+            in which the selected shells are 1, else are nan.
+
+        '''
+
+        aqn = self._attributes[:, :, 7]
+        nu = self._attributes[:, :, 2]
+
+        with np.errstate(invalid='ignore'):
+            is_selected = np.stack([
+                self._valence == 1,  # all _valence
+                aqn == 0,  # single shell
+                aqn == 1,
+                aqn == 2,
+                aqn == 3,
+                nu == 0,  # sat: fully occupied
+                nu > 0,  # unsat: not fully occupied
+                aqn <= 1,  # outer: outer shells in real space (s and p shells)
+                aqn >= 2,  # inner: inner shells in real space (d and f shells)
+            ], axis=-1)
+
+        return np.where(is_selected, 1.0, np.nan)
+
+    def _get_shell_attribute_array(self):
+        # (elements x shells x attributes x selections)
+        return self._attributes[:, :, :, None] * self._shell_selection[:, :, None, :]
+
+    def _get_shell_attributes(self):
+        '''
+        Getting shell attributes.
+
+        A shell_attribute = [attribute].[_shell_selection]
+
+        Returns
+        -------
+        shell_attributes : dict
+            Attributes of selected shells,
+            each of its values is a Pandas DataFrame (index=elemnts, columns=shells).
+
+        '''
+
+        shell_attribute_array = self._get_shell_attribute_array()
+
+        shell_attributes = {}
+        for i, oa in enumerate(self._attribute_names):
+            for j, ss in enumerate(self._selection_names):
+                shell_attributes[oa + '.' + ss] = pd.DataFrame(
+                    shell_attribute_array[:, :, i, j], index=self._elements, columns=self._shells
+                )
+
+        return shell_attributes
+
+    def get_elemental_attribute_array(self):
+        '''
+        Getting elemental attributes as an array,
+        all attributes, selections and math operators at once, reducing over the shells.
+
+        Returns
+        -------
+        names : list
+            [attribute].[_shell_selection].[math operator]
+        elemental_attribute_array : ndarray
+            (names x elements), rounded to 6 decimals.
+
+        '''
+
+        shell_attribute = self._get_shell_attribute_array()
+        weights = (self._valence_number_of_filled[:, :, None] * self._shell_selection)[:, :, None, :]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # elements of empty shells give nan.
+            atomic_avg = np.nanmean(shell_attribute, axis=1)  # atomic_avg = nan when all_shells_are_empty.
+            atomic_std = np.nanstd(shell_attribute, axis=1)
+            atomic_max = np.nanmax(shell_attribute, axis=1)
+            atomic_min = np.nanmin(shell_attribute, axis=1)
+            atomic_range = atomic_max - atomic_min
+
+            is_nan = atomic_avg - atomic_avg  # if all_shells_are_empty is_nan = nan, else is_nan = 0.
+            atomic_sum = np.nansum(shell_attribute, axis=1) + is_nan  # when the whole row is empty, the atomic_sum is nan.
+            atomic_wavg = np.nansum(shell_attribute * weights, axis=1) / np.nansum(weights, axis=1) + is_nan  # when the whole row is empty, the atomic_wavg is nan.
+
+        # (elements x attributes x selections x operators) -> (names x elements)
+        elemental_attribute_array = np.stack(
+            [atomic_avg, atomic_std, atomic_max, atomic_min, atomic_range, atomic_sum, atomic_wavg], axis=-1
+        )
+        elemental_attribute_array = np.round(elemental_attribute_array, 6).reshape(len(self._elements), -1).T
+
+        names = [
+            oa + '.' + ss + '.' + op
+            for oa in self._attribute_names for ss in self._selection_names for op in self._operator_names
+        ]
+
+        return names, elemental_attribute_array
+
+    def _get_elemental_attributes(self):
+        '''
+        Getting elemental attributes.
+
+        A elemental_attribute = [attribute].[_shell_selection].[math operator]
+
+        Returns
+        -------
+        elemental_attributes : dict
+            Elemental attributes.
+
+        '''
+
+        names, elemental_attribute_array = self.get_elemental_attribute_array()
+        elemental_attributes = {
+            name: dict(zip(self._elements, a)) for name, a in zip(names, elemental_attribute_array.tolist())
+        }
+
+        return elemental_attributes
+
+
+@lru_cache(maxsize=32)
+def get_orbital_attributes_of_elements(energy_threshold=-36, cache_dir=None):
+    '''
+    Getting the elemental attributes with a given energy_threshold,
+    the table of elemental_data.orbital_attributes_of_elements (energy_threshold = -36 eV).
+    The tables of the recently used thresholds are kept in memory,
+    and, if cache_dir is given, on disk as well (see electron_orbital_attribute.save()).
+
+    Parameters
+    ----------
+    energy_threshold : float
+        the shells in [0, energy_threshold] (eV) are considered as valence shells.
+    cache_dir : str, optional
+        directory of the saved tables.
+
+    Returns
+    -------
+    df_orbital_attributes_of_elements : DataFrame
+        attributes as index, elements as columns.
+        It is shared by the callers, do not modify it in place.
+
+    '''
+
+    eoa = electron_orbital_attribute(energy_threshold)
+    if cache_dir is not None and not eoa.load(cache_dir):
+        eoa.save(cache_dir)
+    df_orbital_attributes_of_elements = pd.DataFrame.from_dict(eoa.elemental_attributes, orient='index')
+
+    return df_orbital_attributes_of_elements
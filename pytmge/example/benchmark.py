@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of the crystal pipeline.
+
+Each stage runs in a fresh process, on example.csv or on synthetic datasets,
+reporting the wall time, the items per second and the peak RSS.
+The features of the first entries of example.csv are checked against df_features.csv.
+
+    python -m pytmge.example.benchmark
+    python -m pytmge.example.benchmark --sizes example 1000 10000 100000 1000000 --save results.json
+    python -m pytmge.example.benchmark --compare results.json
+
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+_path = Path(__file__).absolute().parent
+
+# max number of entries of each stage, the distances are quadratic and the features are 3528 per entry.
+_stages = {
+    'import': None,
+    'extract_composition': None,
+    'get_features': 20000,
+    'delete_duplicates': None,
+    'categorization_by_composition': None,
+    'subset': None,
+    'distances_within_dataset': 5000,
+    'distances_between_datasets': 5000,
+}
+
+
+def get_dataset(size):
+    '''
+    Getting a dataset for the benchmarks.
+
+    Parameters
+    ----------
+    size : str or int
+        'example' for example.csv, or the number of entries of a synthetic dataset,
+        half of them drawn from example.csv (with duplicates), half of them random formulas.
+        The formulas are not parsed here, so that no stage finds them in the cache of parse_formula.
+
+    Returns
+    -------
+    df_dataset : DataFrame
+        chemical formulas as index.
+
+    '''
+
+    df_example = pd.read_csv(_path / 'example.csv', index_col=0)
+    if size == 'example':
+        return df_example
+
+    from pytmge.core import element_list
+
+    size = int(size)
+    rng = np.random.RandomState(0)
+    elements = np.array(element_list[:94])  # up to Pu.
+
+    n_drawn = size // 2
+    cfs = list(df_example.index[rng.randint(0, df_example.shape[0], n_drawn)])
+    for n_elements in rng.randint(1, 6, size - n_drawn):
+        contents = np.round(rng.uniform(0.01, 8, n_elements), 2)
+        cfs.append(''.join(e + str(c) for e, c in zip(rng.choice(elements, n_elements, replace=False), contents)))
+
+    df_dataset = pd.DataFrame({'measured_Tc': rng.uniform(0, 100, size)}, index=cfs)
+
+    return df_dataset
+
+
+def _run_stage(stage, df_dataset):
+    # returns the number of items processed.
+    from pytmge.core.crystal import extract_composition, feature_design, data_preparation
+
+    if stage == 'extract_composition':
+        extract_composition(df_dataset, sparse=True)
+    elif stage == 'get_features':
+        feature_design.get_features(df_dataset, dtype='float32')
+    elif stage == 'delete_duplicates':
+        data_preparation.delete_duplicates(df_dataset)
+    elif stage == 'categorization_by_composition':
+        data_preparation.categorization_by_composition(df_dataset)
+    elif stage == 'subset':
+        data_preparation.subset(df_dataset)
+    elif stage == 'distances_within_dataset':
+        data_preparation.distances_within_dataset(df_dataset)
+    elif stage == 'distances_between_datasets':
+        n = df_dataset.shape[0] // 2
+        data_preparation.distances_between_datasets(df_dataset.iloc[:n, :], df_dataset.iloc[n:, :])
+
+    return df_dataset.shape[0]
+
+
+def _peak_rss():
+    # peak resident set size of this process, in MB.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+# the import of pytmge is timed in a bare interpreter, after numpy and pandas,
+# which are not ours to speed up.
+_import_code = '''
+import time
+import numpy
+import pandas
+start = time.perf_counter()
+import pytmge.core
+wall_time = time.perf_counter() - start
+from pytmge.example.benchmark import _result
+_result('import', '-', 1, wall_time)
+'''
+
+
+def _result(stage, size, items, wall_time, setup_rss_mb=None):
+    # printing the result as json, on the last line of the output of the process.
+    print(json.dumps({
+        'stage': stage, 'size': str(size), 'items': items,
+        'wall_time': wall_time, 'items_per_second': items / wall_time,
+        'peak_rss_mb': _peak_rss(), 'setup_rss_mb': setup_rss_mb
+    }))
+
+
+def _child(stage, size):
+    # running one stage in this (fresh) process.
+    from pytmge.core.plugins import set_progress
+    set_progress(enabled=False)
+    df_dataset = get_dataset(size)
+    limit = _stages[stage]
+    if limit is not None:
+        df_dataset = df_dataset.iloc[:limit, :]
+    setup_rss_mb = _peak_rss()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        items = _run_stage(stage, df_dataset)
+        wall_time = time.perf_counter() - start
+
+    _result(stage, size, items, wall_time, setup_rss_mb)
+
+
+def run(stages, sizes):
+    '''
+    Running the stages on the datasets of the sizes, each in a fresh process.
+
+    The peak RSS of a stage is that of its process, including the setup (the import and the dataset),
+    whose own peak is given as setup_rss_mb, so a stage used little memory if the two are close.
+
+    Returns
+    -------
+    results : list
+        dicts of stage, size, items, wall_time (s), items_per_second, peak_rss_mb and setup_rss_mb.
+    failures : list
+        (stage, size) of the stages that failed.
+
+    '''
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(_path.parent.parent), os.environ.get('PYTHONPATH', '')]))
+    results = []
+    failures = []
+    for size in sizes:
+        for stage in stages:
+            if stage == 'import':
+                if size != sizes[0]:
+                    continue
+                command = [sys.executable, '-c', _import_code]
+            else:
+                command = [sys.executable, '-m', 'pytmge.example.benchmark', '--child', stage, str(size)]
+            completed = subprocess.run(command, capture_output=True, text=True, env=env)
+            if completed.returncode != 0:
+                # no error message if the process was killed, e.g. out of memory.
+                lines = completed.stderr.strip().splitlines()
+                print('%-32s %10s  failed\n%s' % (
+                    stage, size, lines[-1] if lines else 'exit code %d' % completed.returncode
+                ))
+                failures.append((stage, str(size)))
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print('%-32s %10s %10d items %10.3f s %12.0f /s %10s MB peak %10s MB setup' % (
+                stage, result['size'], result['items'], result['wall_time'], result['items_per_second'],
+                '-' if result['peak_rss_mb'] is None else '%.0f' % result['peak_rss_mb'],
+                '-' if result.get('setup_rss_mb') is None else '%.0f' % result['setup_rss_mb']
+            ))
+
+    return results, failures
+
+
+def check_features(n=3, atol=1e-6):
+    '''
+    Checking the features of the first n entries of example.csv against df_features.csv.
+
+    Returns
+    -------
+    is_ok : bool
+
+    '''
+
+    from pytmge.core.crystal import feature_design
+    from pytmge.core.plugins import set_progress
+
+    set_progress(enabled=False)
+    df_reference = pd.read_csv(_path / 'df_features.csv', index_col=0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        df_features = feature_design.get_features(pd.read_csv(_path / 'example.csv', index_col=0).iloc[:n, :])
+
+    is_ok = (
+        list(df_features.index) == list(df_reference.index)
+        and list(df_features.columns) == list(df_reference.columns)
+        and np.allclose(df_features.values, df_reference.values, rtol=0, atol=atol, equal_nan=True)
+    )
+    print('features vs df_features.csv:', 'ok' if is_ok else 'MISMATCH')
+
+    return is_ok
+
+
+def compare(results, baseline, tolerance=1.5):
+    '''
+    Comparing the wall times with those of a baseline (saved by --save).
+
+    Returns
+    -------
+    is_ok : bool
+        False if any stage is slower than tolerance times the baseline.
+
+    '''
+
+    baseline = {(r['stage'], r['size']): r for r in baseline}
+    is_ok = True
+    for result in results:
+        base = baseline.get((result['stage'], result['size']))
+        if base is None:
+            continue
+        ratio = result['wall_time'] / base['wall_time']
+        if ratio > tolerance:
+            is_ok = False
+            print('slower: %s %s %.2f x' % (result['stage'], result['size'], ratio))
+
+    return is_ok
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmarks of the crystal pipeline.')
+    parser.add_argument('--sizes', nargs='+', default=['example', '1000', '10000', '100000', '1000000'])
+    parser.add_argument('--stages', nargs='+', default=list(_stages), choices=list(_stages))
+    parser.add_argument('--save', help='json file to save the results to.')
+    parser.add_argument('--compare', help='json file of baseline results.')
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(*args.child)
+        sys.exit(0)
+
+    is_ok = check_features()
+    results, failures = run(args.stages, args.sizes)
+    is_ok = is_ok and not failures
+    if args.save:
+        with open(args.save, 'w') as _f:
+            json.dump(results, _f, indent=1)
+    if args.compare:
+        with open(args.compare) as _f:
+            is_ok = compare(results, json.load(_f), args.tolerance) and is_ok
+
+    sys.exit(0 if is_ok else 1)